@@ -1,58 +1,101 @@
 
-from flask import Flask, render_template, jsonify, make_response, request, session, redirect, url_for
+from flask import Flask, Response, render_template, jsonify, request, session, redirect, url_for, stream_with_context, g
 from flask_cors import CORS
-from functools import wraps
-import requests
+from functools import wraps, cached_property
+from contextlib import contextmanager
+import importlib
 import sys
-import pytz
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
 import sqlite3
-import urllib3
 import base64
+import re
+import calendar
+import unicodedata
 import orjson
 import time
-from Crypto.Cipher import AES, PKCS1_OAEP
-from Crypto.PublicKey import RSA
-from Crypto.Random import get_random_bytes
-from Crypto.Hash import SHA256 
+import math
+import random
+import gzip
+import zlib
+import mmap
+import struct
 
 import sqlite3
 import threading
+import queue
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from dotenv import load_dotenv
 import os
-from supabase import create_client, Client
 from flask_compress import Compress
-from waitress import serve
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+class LazyModule:
+    """İlk öznitelik erişiminde import edilen modül vekili.
+
+    Soğuk başlangıçta (/api/veriler kalıcı anlık görüntüden sunulurken) gerekmeyen ağır modüller
+    için; import sonrası modül globali gerçek modüle bağlanır, sonraki erişimler doğrudandır.
+    """
+
+    def __init__(self, name, alias):
+        self._name = name
+        self._alias = alias
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self._name)
+        globals()[self._alias] = module
+        return getattr(module, attr)
+
+np = LazyModule("numpy", "np")
 
 # Load environment variables
 load_dotenv()
 
-# SSL Uyarılarını Kapat
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
 base_dir = os.path.dirname(os.path.abspath(__file__))
 frontend_dir = os.path.join(base_dir, '..', 'frontend')
 app = Flask(__name__, template_folder=os.path.join(base_dir, '..'), static_folder=os.path.join(base_dir, '..', 'static'))
 Compress(app)
 app.secret_key = os.getenv('FLASK_SECRET_KEY', 'iett-default-secret-key-2025')
-CORS(app, resources={r"/api/*": {"origins": ["https://source-dews.github.io", "https://source-dew.github.io", "http://127.0.0.1:5500", "http://localhost:5500"]}}, supports_credentials=True)
+CORS(app, resources={r"/api/*": {"origins": ["https://source-dews.github.io", "https://source-dew.github.io", "http://127.0.0.1:5500", "http://localhost:5500"]}}, supports_credentials=True, expose_headers=[
+    # github.io ön yüzü API'ye cross-origin erişir; bu başlıklar açıkça okunabilir kılınmalı
+    "ETag", "X-Snapshot-Version", "X-Snapshot-Epoch", "X-Snapshot-Age", "X-Snapshot-Source",
+    "X-Total-Count", "X-Live-Stream",
+])
 
 # Lokal geçmiş veritabanı yolu (Vercel için /tmp kullanıyoruz)
 HISTORY_DB = "/tmp/vehicle_history.db" if os.getenv('VERCEL') else os.getenv('HISTORY_DB', 'vehicle_history.db')
 
-# Initialize Supabase
+# Supabase sadece admin uçlarında kullanılır; istemci ilk kullanımda kurulup paylaşılır
 supabase_url = os.getenv('SUPABASE_URL')
 supabase_key = os.getenv('SUPABASE_KEY')
-try:
-    supabase: Client = create_client(supabase_url, supabase_key)
-except:
-    supabase = None
-    print("Supabase init failed")
+SUPABASE_STATE = {"client": None, "failed": False, "lock": threading.Lock()}
+
+def get_supabase():
+    """Paylaşılan Supabase istemcisi; kurulamazsa None (hata bir kez yazılır, tekrar denenmez)."""
+    state = SUPABASE_STATE
+    if state["client"] or state["failed"]: return state["client"]
+    with state["lock"]:
+        if state["client"] is None and not state["failed"]:
+            try:
+                from supabase import create_client
+                state["client"] = create_client(supabase_url, supabase_key)
+            except Exception:
+                state["failed"] = True
+                print("Supabase init failed")
+    return state["client"]
 
 # --- İETT AYARLARI ---
-PUBKEY_URL = "https://arac.iett.gov.tr/api/task/crypto/pubkey"
-DATA_URL = "https://arac.iett.gov.tr/api/task/bus-fleet/buses"
-TASK_URL_TMPL = "https://arac.iett.gov.tr/api/task/getCarTasks/{door_code}"
+# Benchmark / yerel test için sahte sunucuya yönlendirilebilir (backend/bench/fake_upstream.py)
+IETT_BASE_URL = os.getenv('IETT_BASE_URL', 'https://arac.iett.gov.tr').rstrip('/')
+PUBKEY_URL = f"{IETT_BASE_URL}/api/task/crypto/pubkey"
+DATA_URL = f"{IETT_BASE_URL}/api/task/bus-fleet/buses"
+TASK_URL_TMPL = IETT_BASE_URL + "/api/task/getCarTasks/{door_code}"
 
 HEADERS = {
     "Content-Type": "application/json",
@@ -62,107 +105,1237 @@ HEADERS = {
     "Connection": "keep-alive"
 }
 
+# --- METRİKLER (Prometheus metin formatı, /api/metrics) ---
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRIC_HELP = {
+    "iett_refresh_stage_seconds": ("histogram", "Yenileme hattı aşama süreleri (kind: fleet / tasks)"),
+    "iett_http_request_seconds": ("histogram", "Route başına yanıt üretme süresi (akışlarda ilk bayta kadar)"),
+    "iett_upstream_errors_total": ("counter", "IETT istek / şifre çözme hataları"),
+    "iett_upstream_retries_total": ("counter", "Reddedilen oturum anahtarı sonrası tekrar denemeler"),
+    "iett_pubkey_rotations_total": ("counter", "Üst üste reddedilen anahtar yüzünden yenilenen pubkey sayısı (kind: fleet / tasks)"),
+    "iett_refresh_total": ("counter", "Yenileme denemeleri (sonuca göre)"),
+    "iett_refresh_backoff_total": ("counter", "Background worker bekleme (backoff) sayısı"),
+    "iett_poll_decisions_total": ("counter", "Yoklama zamanlayıcısı kararları (reason: change_rate / idle / failure_backoff / breaker_open)"),
+    "iett_breaker_trips_total": ("counter", "Devre kesicinin açılma sayısı (cause: errors / pubkey / probe)"),
+}
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+class Metrics:
+    """Süreç içi sayaç ve gecikme histogramları; gözlem başına bir bisect ve kilitli toplama."""
+
+    def __init__(self):
+        self.histograms = {}  # (ad, etiketler) -> Histogram
+        self.counters = {}    # (ad, etiketler) -> sayı
+        self.lock = threading.Lock()
+
+    def observe(self, name, seconds, **labels):
+        i = bisect_left(LATENCY_BUCKETS, seconds)
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram()
+            hist.counts[i] += 1
+            hist.sum += seconds
+            hist.count += 1
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def stage(self, stage, kind="fleet"):
+        return self.timer("iett_refresh_stage_seconds", stage=stage, kind=kind)
+
+    @staticmethod
+    def format_labels(labels, extra=()):
+        # Etiket değerleri sabit adlar (route, aşama, durum kodu); kaçış gerekmez
+        pairs = [*labels, *extra]
+        if not pairs: return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+    def render(self, gauges):
+        """gauges: [(ad, yardım metni, değer)]; sayaç ve histogramlarla birlikte metin formatına çevirir."""
+        with self.lock:
+            histograms = {key: (list(h.counts), h.sum, h.count) for key, h in self.histograms.items()}
+            counters = dict(self.counters)
+
+        lines = []
+        by_name = {}
+        for (name, labels), value in list(histograms.items()) + list(counters.items()):
+            by_name.setdefault(name, []).append((labels, value))
+
+        for name in sorted(by_name):
+            kind, help_text = METRIC_HELP.get(name, ("untyped", name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(by_name[name]):
+                if kind != "histogram":
+                    lines.append(f"{name}{self.format_labels(labels)} {value}")
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, n in zip(LATENCY_BUCKETS + (float("inf"),), counts):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{self.format_labels(labels, [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{self.format_labels(labels)} {total:.6f}")
+                lines.append(f"{name}_count{self.format_labels(labels)} {count}")
+
+        for name, help_text, value in gauges:
+            if isinstance(value, dict):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} gauge")
+                for labels, v in value.items():
+                    lines.append(f"{name}{self.format_labels(labels)} {v}")
+            else:
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+METRICS = Metrics()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    started = g.get('request_started')
+    if started is not None and request.endpoint != 'static':
+        METRICS.observe("iett_http_request_seconds", time.perf_counter() - started,
+                        endpoint=request.endpoint or "unknown", status=response.status_code)
+    return response
+
 # --- HAFIZA AYARLARI ---
 GLOBAL_CACHE = {
     "pubkey": None,
     "data": [],
-    "last_update": 0
+    # Araç sayısı; okuyucu süreçte liste ayrıştırılmadan da bilinir
+    "size": 0,
+    "last_update": 0,
+    "version": 0,
+    # "live": IETT'den çekildi, "persisted": açılışta kalıcı dosyadan yüklendi
+    "source": None,
+    # Normalize kapı kodu (vehicleDoorCode / busDoorNumber / doorNumber) -> araç kaydı
+    "index": {},
+    # Filtreleme için yenileme başına hesaplanan (araç, şirket, zaman, ...) kayıtları
+    "attrs": [],
+    # Konum ızgarası: (satır, sütun) hücresi -> [(lat, lng, araç), ...]
+    "grid": {},
+    # Sürüm başına bir kez üretilen ETag, JSON gövdesi ("identity") ve sıkıştırılmış halleri
+    "encoded": {"etag": None, "identity": b"[]"}
 }
 
-TASK_CACHE = {}
 TASK_CACHE_DURATION = 600
+# Boş liste / hata sonuçları kısa süre tutulur ki IETT'ye tekrar tekrar gidilmesin
+TASK_NEGATIVE_CACHE_DURATION = 30
+TASK_CACHE_MAX_ENTRIES = 5000
 CACHE_DURATION = 1.5
 
 # Son bilinen konumları hafızada tutarak gereksiz DB yazımını engeller
 LAST_KNOWN_LOCATIONS = {} 
 
+# --- BELLEK İÇİ GEÇMİŞ AYARLARI ---
+# Araç başına tutulacak en fazla nokta (konum değiştikçe eklenir)
+HISTORY_RING_CAPACITY = int(os.getenv('HISTORY_RING_CAPACITY', 2400))
+# Tüm araçlar için toplam üst sınır; aşılırsa en uzun süredir güncellenmeyen araç düşürülür
+HISTORY_MEMORY_LIMIT_MB = int(os.getenv('HISTORY_MEMORY_LIMIT_MB', 128))
+# Açılışta SQLite'tan belleğe yüklenecek süre
+HISTORY_WARM_MINUTES = 10
+
+# --- DELTA AYARLARI ---
+# Süreç her başladığında sürümler sıfırdan sayılır; istemci farklı bir epoch
+# gönderirse (yeniden başlatma / farklı Vercel instance) tam senkron yapılır.
+SNAPSHOT_EPOCH = os.urandom(4).hex()
+# Kaç yenilemelik değişiklik günlüğü tutulacak (1.5 sn ile ~3 dakika)
+DELTA_LOG_SIZE = 120
+SNAPSHOT_CHANGELOG = deque(maxlen=DELTA_LOG_SIZE)
+SNAPSHOT_LOCK = threading.Lock()
+# Kapı kodu -> son yayınlanan araç kaydı (delta için karşılaştırma tabanı)
+LAST_KNOWN_RECORDS = {}
+
+# --- CANLI YAYIN (SSE) AYARLARI ---
+# Yeni sürüm yayınlandığında bekleyen tüm akışlar uyandırılır
+STREAM_COND = threading.Condition()
+# Aynı sürüm için hazırlanan mesajlar tüm abonelerle paylaşılır
+STREAM_MESSAGES = {}
+STREAM_MESSAGES_LOCK = threading.Lock()
+STREAM_KEEPALIVE = 15
+# Vercel fonksiyon süresini aşmamak için bağlantı kapatılır, EventSource kendisi yeniden bağlanır
+STREAM_MAX_SECONDS = 55
+# Her açık akış bir waitress thread'i tutar; thread'lerin en fazla dörtte biri akışlara verilir,
+# dolunca 503 döner ve istemci delta polling'e düşer. Vercel'de her akış bir fonksiyon
+# çağrısını açık tutacağı için akış kapalıdır.
+STREAM_MAX_SUBSCRIBERS = 0 if os.getenv('VERCEL') else int(
+    os.getenv('STREAM_MAX_SUBSCRIBERS', max(1, int(os.getenv('WAITRESS_THREADS', 32)) // 4))
+)
+STREAM_STATE = {"subscribers": 0, "lock": threading.Lock()}
+
+# --- YENİLEME KOORDİNATÖRÜ AYARLARI ---
+# Vercel'de istek bitince thread'ler dondurulur; orada yenileme istek güdümlüdür
+IS_SERVERLESS = bool(os.getenv('VERCEL'))
+# standalone: tek süreç her şeyi yapar; fetcher: IETT'yi yoklar ve nesil dosyalarını yayınlar;
+# reader: sadece fetcher'ın nesillerini sunar, IETT'ye filo isteği atmaz (bkz. --workers)
+PROCESS_ROLE = os.getenv('IETT_PROCESS_ROLE', 'standalone')
+# İstek güdümlü modda bundan eski veri sunulmaz, yenileme beklenir
+STALE_MAX_AGE = 30
+REFRESH_WAIT_TIMEOUT = 10
+REFRESH_COND = threading.Condition()
+REFRESH_STATE = {
+    "in_flight": False,
+    "last_attempt": 0,
+    "last_ok": False,
+    "workers_started": False,
+    # Background worker'ın ardışık başarısız yenileme sayısı ve şu anki bekleme süresi
+    "consecutive_errors": 0,
+    "backoff_seconds": 0
+}
+
+# --- TOPLU ANALİZ AYARLARI ---
+# Aynı anda en fazla bu kadar kapı için IETT'ye gidilir (tüm batch istekleri paylaşır)
+BATCH_MAX_WORKERS = 8
+BATCH_DOOR_TIMEOUT = 12
+BATCH_TOTAL_TIMEOUT = 120
+BATCH_EXECUTOR = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix="batch")
+
+# --- HAZIR GÖVDE AYARLARI ---
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+ENCODE_LOCK = threading.Lock()
+
 # --- VERİTABANI İŞLEMLERİ (WAL Modu) ---
-def init_db():
+# Geçmiş zaman dilimlerine bölünmüş tablolarda tutulur (history_<dilim>); süresi dolan dilim
+# DELETE + VACUUM yerine tek bir DROP TABLE ile silinir.
+HISTORY_RETENTION_MINUTES = int(os.getenv('HISTORY_RETENTION_MINUTES', 240))
+HISTORY_BUCKET_SECONDS = int(os.getenv('HISTORY_BUCKET_SECONDS', 600))
+HISTORY_TABLE_RE = re.compile(r'^history_(\d+)$')
+
+def history_table(bucket):
+    return f"history_{bucket}"
+
+def create_history_bucket(conn, bucket):
+    """Dilim tablosu (door_number, timestamp) üzerinde kümelenmiş WITHOUT ROWID."""
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {history_table(bucket)} (
+            door_number TEXT NOT NULL,
+            timestamp INTEGER NOT NULL,
+            latitude REAL,
+            longitude REAL,
+            PRIMARY KEY (door_number, timestamp)
+        ) WITHOUT ROWID
+    """)
+
+def list_history_buckets(conn):
+    rows = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'history_%'").fetchall()
+    return sorted(int(m.group(1)) for m in (HISTORY_TABLE_RE.match(name) for (name,) in rows) if m)
+
+def history_buckets_since(conn, cutoff_ts):
+    """[cutoff_ts, şimdi] aralığıyla kesişen dilimler (eskiden yeniye)."""
+    first = cutoff_ts // HISTORY_BUCKET_SECONDS
+    return [bucket for bucket in list_history_buckets(conn) if bucket >= first]
+
+def insert_history_rows(conn, rows, known_buckets):
+    """(kapı, lat, lng, zaman) satırlarını dilimlerine dağıtıp yazar. Yeni dilim açıldıysa True."""
+    by_bucket = {}
+    for row in rows:
+        by_bucket.setdefault(row[3] // HISTORY_BUCKET_SECONDS, []).append(row)
+
+    created = False
+    for bucket, bucket_rows in by_bucket.items():
+        if bucket not in known_buckets:
+            create_history_bucket(conn, bucket)
+            known_buckets.add(bucket)
+            created = True
+        conn.executemany(
+            f"INSERT OR REPLACE INTO {history_table(bucket)} (door_number, latitude, longitude, timestamp) VALUES (?, ?, ?, ?)",
+            bucket_rows,
+        )
+    return created
+
+def expire_history_buckets(conn, known_buckets):
+    """Saklama süresinin tamamen dışında kalan dilimleri düşürür."""
+    cutoff_ts = int(time.time()) - HISTORY_RETENTION_MINUTES * 60
+    dropped = 0
+    for bucket in list_history_buckets(conn):
+        if (bucket + 1) * HISTORY_BUCKET_SECONDS <= cutoff_ts:
+            conn.execute(f"DROP TABLE IF EXISTS {history_table(bucket)}")
+            known_buckets.discard(bucket)
+            dropped += 1
+    if dropped:
+        print(f"[CLEANUP] Dropped {dropped} expired history buckets.")
+
+def read_history_buckets(conn, reader):
+    """Dilim listesi okunduktan sonra yazıcı bir dilimi düşürmüşse okumayı bir kez tekrarlar."""
     try:
-        with sqlite3.connect(HISTORY_DB) as conn:
-            cur = conn.cursor()
-            cur.execute("PRAGMA journal_mode=WAL;")
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS history (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    door_number TEXT,
-                    latitude REAL,
-                    longitude REAL,
-                    timestamp INTEGER
-                );
-            """)
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_door_time ON history (door_number, timestamp)")
-            conn.commit()
+        return reader(conn)
+    except sqlite3.OperationalError as e:
+        if "no such table" not in str(e): raise
+        return reader(conn)
+
+def init_db(conn=None):
+    """WAL modunu açar, tek tablolu eski şemayı (history) zaman dilimlerine taşır."""
+    try:
+        own_conn = conn is None
+        if own_conn:
+            conn = sqlite3.connect(HISTORY_DB)
+        conn.execute("PRAGMA journal_mode=WAL;")
+
+        legacy = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'history'").fetchone()
+        if legacy:
+            cutoff_ts = int(time.time()) - HISTORY_RETENTION_MINUTES * 60
+            with conn:
+                rows = conn.execute(
+                    "SELECT door_number, latitude, longitude, timestamp FROM history "
+                    "WHERE door_number IS NOT NULL AND timestamp >= ?",
+                    (cutoff_ts,),
+                ).fetchall()
+                insert_history_rows(conn, rows, set(list_history_buckets(conn)))
+                conn.execute("DROP TABLE history")
+        if own_conn:
+            conn.close()
     except Exception as e:
         print(f"DB Init Error: {e}")
 
-def save_data_to_db(vehicle_list):
-    if not vehicle_list: return
-    
-    now = int(time.time())
-    new_records = []
-    
+class HistoryWriter:
+    """Tek yazıcı thread: kuyruktaki geçmiş kayıtlarını kalıcı bağlantıyla toplu commit eder.
+
+    Birkaç yenilemenin kayıtları tek transaction'da yazılır (group commit). Okumalar bellekten
+    yapıldığı için yazım gecikmesi kullanıcıya yansımaz. Yeni bir zaman dilimi açıldığında
+    süresi dolan dilimler düşürülür. Vercel'de yanıt sonrası thread'ler dondurulduğu için kuyruk
+    kullanılmaz, her grup çağıranın thread'inde yazılır.
+    """
+
+    # Bir transaction'da en fazla bu kadar bekle / bu kadar satır topla
+    COMMIT_INTERVAL = 3.0
+    COMMIT_MAX_ROWS = 50000
+    QUEUE_SIZE = 1000
+
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=self.QUEUE_SIZE)
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.thread = None
+        self.conn = None
+        self.buckets = set()
+
+    def start(self):
+        with self.lock:
+            if self.thread and self.thread.is_alive(): return
+            self.thread = threading.Thread(target=self.run, name="history-writer", daemon=True)
+            self.thread.start()
+
+    def submit(self, records):
+        if not records: return
+        if IS_SERVERLESS:
+            self.commit([("insert", records)])
+            return
+        self.start()
+        try:
+            self.queue.put_nowait(("insert", records))
+        except queue.Full:
+            # Bellekteki geçmiş etkilenmez, sadece kalıcı kopyadan düşer
+            print(f"DB Write Queue Full: {len(records)} records dropped")
+
+    def submit_command(self, command, *args):
+        if IS_SERVERLESS:
+            self.commit([(command, *args)])
+            return
+        self.start()
+        self.queue.put((command, *args))
+
+    def flush(self):
+        """Kuyruktaki her şey yazılana kadar bekler."""
+        self.start()
+        self.queue.join()
+
+    def connect(self):
+        conn = sqlite3.connect(HISTORY_DB, cached_statements=64)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-16000")
+        init_db(conn)
+        self.buckets = set(list_history_buckets(conn))
+        return conn
+
+    def run(self):
+        while True:
+            items = [self.queue.get()]
+            rows = len(items[0][1]) if items[0][0] == "insert" else 0
+            deadline = time.monotonic() + self.COMMIT_INTERVAL
+
+            # Group commit: zaman dolana veya yeterli satır birikene kadar topla
+            while rows < self.COMMIT_MAX_ROWS and items[-1][0] == "insert":
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                items.append(item)
+                if item[0] == "insert": rows += len(item[1])
+
+            try:
+                self.commit(items)
+            finally:
+                for _ in items:
+                    self.queue.task_done()
+
+    def commit(self, items):
+        """Bir grup öğeyi yazar; hata olursa bağlantı bir sonraki grupta yeniden açılır."""
+        with self.write_lock:
+            try:
+                if self.conn is None or not os.path.exists(HISTORY_DB):
+                    self.conn = self.connect()
+                self.write(items)
+            except Exception as e:
+                print(f"DB Write Error: {e}")
+                try:
+                    self.conn.close()
+                except Exception:
+                    pass
+                self.conn = None
+
+    def write(self, items):
+        conn = self.conn
+        records = [row for item in items if item[0] == "insert" for row in item[1]]
+        with METRICS.stage("history_write"), conn:
+            created = insert_history_rows(conn, records, self.buckets)
+        # Yeni dilime geçildiyse veya temizlik istendiyse eski dilimleri düşür
+        expire = created or any(item[0] == "expire" for item in items)
+        if expire:
+            with conn:
+                expire_history_buckets(conn, self.buckets)
+
+        # Uzun süreli arşiv SQLite'tan bağımsız; hatası geçmiş yazımını bozmaz
+        try:
+            TRACK_ARCHIVE.add(records)
+            if expire: TRACK_ARCHIVE.expire()
+        except Exception as e:
+            print(f"Archive Write Error: {e}")
+
+HISTORY_WRITER = HistoryWriter()
+
+def save_data_to_db(new_records):
+    """diff_snapshot'ın ürettiği (kapı, lat, lng, zaman) kayıtlarını yazıcı kuyruğuna bırakır."""
+    HISTORY_WRITER.submit(new_records)
+
+# --- UZUN SÜRELİ ARŞİV (saatlik, sıkıştırılmış) ---
+# Her saat için iki dosya: <YYYYMMDDHH>.trk (blok blok eklenen sıkıştırılmış sütunlar) ve
+# <YYYYMMDDHH>.idx (her blok parçası için sabit boyutlu indeks kaydı). Dosyalara sadece eklenir.
+ARCHIVE_DIR = os.getenv('HISTORY_ARCHIVE_DIR') or os.path.join(os.path.dirname(os.path.abspath(HISTORY_DB)), 'history_archive')
+ARCHIVE_FLUSH_SECONDS = int(os.getenv('ARCHIVE_FLUSH_SECONDS', 60))
+ARCHIVE_RETENTION_DAYS = int(os.getenv('ARCHIVE_RETENTION_DAYS', 30))
+ARCHIVE_ZLIB_LEVEL = 6
+ARCHIVE_COORD_SCALE = 1e6      # sabit nokta: 1e-6 derece (~0.1 m)
+ARCHIVE_DOOR_BYTES = 16
+REPLAY_MAX_SECONDS = 24 * 3600
+# /api/replay zaman sınırı (9999-12-31 UTC); arşiv dosya adları '%Y%m%d%H'
+REPLAY_MAX_TIMESTAMP = 253402300799
+
+class TrackArchive:
+    """Saatlik dosyalarda kapı başına delta kodlu int32 (lat, lng, saat içi saniye) sütunları.
+
+    Yazıcı thread noktaları ARCHIVE_FLUSH_SECONDS boyunca biriktirip her kapı için tek bir zlib
+    parçası ekler; önce veri, sonra indeks yazıldığı için yarım kalan yazım okunmaz. Okumada .trk
+    dosyası mmap edilir, sadece istenen kapı/aralıkla kesişen parçalar açılır ve np.cumsum ile
+    geri kurulur.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.pending = {}  # saat -> kapı -> [(lat, lng, zaman), ...]
+        self.last_flush = time.monotonic()
+
+    @cached_property
+    def index_dtype(self):
+        return np.dtype([
+            ('door', f'S{ARCHIVE_DOOR_BYTES}'),
+            ('offset', '<u8'),
+            ('length', '<u4'),
+            ('count', '<u4'),
+            ('ts_min', '<i8'),
+            ('ts_max', '<i8'),
+        ])
+
+    def paths(self, hour):
+        name = time.strftime('%Y%m%d%H', time.gmtime(hour * 3600))
+        base = os.path.join(self.directory, name)
+        return base + '.trk', base + '.idx'
+
+    def add(self, records):
+        """Sadece HistoryWriter.write'tan (yazma kilidi altında) çağrılır."""
+        for door, lat, lng, ts in records:
+            self.pending.setdefault(ts // 3600, {}).setdefault(door, []).append((lat, lng, ts))
+        if self.pending and time.monotonic() - self.last_flush >= ARCHIVE_FLUSH_SECONDS:
+            self.flush()
+
+    def flush(self):
+        pending, self.pending = self.pending, {}
+        self.last_flush = time.monotonic()
+        for hour, doors in pending.items():
+            self.write_block(hour, doors)
+
+    def write_block(self, hour, doors):
+        os.makedirs(self.directory, exist_ok=True)
+        trk_path, idx_path = self.paths(hour)
+        base_ts = hour * 3600
+        entries = []
+        with open(trk_path, 'ab') as f:
+            offset = f.tell()
+            for door, points in doors.items():
+                door_key = door.encode()
+                if len(door_key) > ARCHIVE_DOOR_BYTES: continue
+                points.sort(key=lambda point: point[2])
+                columns = np.array(points, dtype=float).T
+                fixed = np.stack((
+                    np.round(columns[0] * ARCHIVE_COORD_SCALE),
+                    np.round(columns[1] * ARCHIVE_COORD_SCALE),
+                    columns[2] - base_ts,
+                )).astype(np.int32)
+                # İlk değer mutlak, sonrakiler bir öncekine göre fark
+                payload = zlib.compress(np.diff(fixed, axis=1, prepend=0).astype('<i4').tobytes(), ARCHIVE_ZLIB_LEVEL)
+                f.write(payload)
+                entries.append((door_key, offset, len(payload), len(points), points[0][2], points[-1][2]))
+                offset += len(payload)
+        if entries:
+            with open(idx_path, 'ab') as f:
+                f.write(np.array(entries, dtype=self.index_dtype).tobytes())
+
+    def load_index(self, idx_path):
+        with open(idx_path, 'rb') as f:
+            raw = f.read()
+        # Yarım yazılmış son kayıt yok sayılır
+        usable = len(raw) - len(raw) % self.index_dtype.itemsize
+        return np.frombuffer(raw[:usable], dtype=self.index_dtype)
+
+    def read(self, start_ts, end_ts, doors=None):
+        """{kapı: (lat, lng, zaman)} numpy dizileri, zamana göre sıralı; doors None ise tüm filo."""
+        door_keys = np.array([d.encode() for d in doors], dtype=self.index_dtype['door']) if doors else None
+        parts = {}
+        for hour in range(start_ts // 3600, end_ts // 3600 + 1):
+            trk_path, idx_path = self.paths(hour)
+            if not os.path.exists(idx_path): continue
+            index = self.load_index(idx_path)
+            mask = (index['ts_max'] >= start_ts) & (index['ts_min'] <= end_ts)
+            if door_keys is not None:
+                mask &= np.isin(index['door'], door_keys)
+            selected = index[mask]
+            if not len(selected): continue
+
+            base_ts = hour * 3600
+            with open(trk_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for entry in selected:
+                    offset = int(entry['offset'])
+                    raw = zlib.decompress(mm[offset:offset + int(entry['length'])])
+                    lat_i, lng_i, ts_i = np.cumsum(np.frombuffer(raw, dtype='<i4').reshape(3, -1), axis=1, dtype=np.int64)
+                    ts = ts_i + base_ts
+                    keep = (ts >= start_ts) & (ts <= end_ts)
+                    parts.setdefault(entry['door'].decode(), []).append((lat_i[keep], lng_i[keep], ts[keep]))
+
+        tracks = {}
+        for door, chunks in parts.items():
+            lat_i, lng_i, ts = (np.concatenate(column) for column in zip(*chunks))
+            order = np.argsort(ts, kind='stable')
+            tracks[door] = (lat_i[order] / ARCHIVE_COORD_SCALE, lng_i[order] / ARCHIVE_COORD_SCALE, ts[order])
+        return tracks
+
+    def expire(self):
+        """ARCHIVE_RETENTION_DAYS'ten eski saat dosyalarını siler."""
+        if not os.path.isdir(self.directory): return
+        cutoff = time.strftime('%Y%m%d%H', time.gmtime(time.time() - ARCHIVE_RETENTION_DAYS * 86400))
+        for name in os.listdir(self.directory):
+            stem, ext = os.path.splitext(name)
+            if ext in ('.trk', '.idx') and stem.isdigit() and stem < cutoff:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError as e:
+                    print(f"Archive Cleanup Error: {e}")
+
+TRACK_ARCHIVE = TrackArchive(ARCHIVE_DIR)
+
+HISTORY_READ_LOCAL = threading.local()
+
+def history_read_conn():
+    """Thread başına açık tutulan okuma bağlantısı."""
+    conn = getattr(HISTORY_READ_LOCAL, "conn", None)
+    if conn is None:
+        conn = HISTORY_READ_LOCAL.conn = sqlite3.connect(HISTORY_DB, cached_statements=32)
+    return conn
+
+# --- BELLEK İÇİ GEÇMİŞ (RING BUFFER) ---
+class VehicleTrack:
+    """Tek bir aracın konum geçmişi: lat/lng/ts tipli dizilerde halka tampon."""
+
+    __slots__ = ("lat", "lng", "ts", "head", "complete_from")
+
+    # Nokta başına bayt (lat + lng + ts)
+    POINT_BYTES = 24
+
+    def __init__(self, complete_from):
+        self.lat = array("d")
+        self.lng = array("d")
+        self.ts = array("q")
+        self.head = 0                       # dolu halkada en eski noktanın yeri
+        self.complete_from = complete_from  # bu zamandan sonrası eksiksiz
+
+    def append(self, lat, lng, ts, capacity):
+        """Nokta ekler; halka doluysa en eskisinin üzerine yazar. Eklenen nokta sayısını döner."""
+        if len(self.ts) < capacity:
+            self.lat.append(lat)
+            self.lng.append(lng)
+            self.ts.append(ts)
+            return 1
+
+        i = self.head
+        self.complete_from = self.ts[i] + 1
+        self.lat[i] = lat
+        self.lng[i] = lng
+        self.ts[i] = ts
+        self.head = (i + 1) % capacity
+        return 0
+
+    def since(self, cutoff_ts):
+        """cutoff_ts ve sonrasındaki noktalar (eskiden yeniye) [(lat, lng, ts), ...]."""
+        h = self.head
+        if h:
+            lat = self.lat[h:] + self.lat[:h]
+            lng = self.lng[h:] + self.lng[:h]
+            ts = self.ts[h:] + self.ts[:h]
+        else:
+            lat, lng, ts = self.lat, self.lng, self.ts
+        start = bisect_left(ts, cutoff_ts)
+        return list(zip(lat[start:], lng[start:], ts[start:]))
+
+class HistoryStore:
+    """Kapı kodu -> VehicleTrack. Geçmiş okumaları bellekten, SQLite sadece kalıcı kopya.
+
+    Bellek bir aralığı eksiksiz kapsamıyorsa (açılış öncesi, taşan halka, düşürülen araç)
+    sorgu None döner ve çağıran SQLite'a düşer.
+    """
+
+    def __init__(self, capacity, memory_limit_mb):
+        self.capacity = capacity
+        self.max_points = memory_limit_mb * 1024 * 1024 // VehicleTrack.POINT_BYTES
+        self.tracks = OrderedDict()  # en son güncellenen sonda
+        self.evicted = set()
+        self.points = 0
+        self.lock = threading.Lock()
+        self.covered_from = int(time.time())
+        self.warmed = False
+
+    def add_many(self, records):
+        """diff_snapshot'ın (kapı, lat, lng, zaman) kayıtlarını ekler."""
+        with self.lock:
+            for door, lat, lng, ts in records:
+                track = self.tracks.get(door)
+                if track is None:
+                    complete_from = ts if door in self.evicted else self.covered_from
+                    self.evicted.discard(door)
+                    track = self.tracks[door] = VehicleTrack(complete_from)
+                else:
+                    self.tracks.move_to_end(door)
+                self.points += track.append(lat, lng, ts, self.capacity)
+
+            while self.points > self.max_points and self.tracks:
+                door, track = self.tracks.popitem(last=False)
+                self.points -= len(track.ts)
+                self.evicted.add(door)
+
+    def query(self, door, cutoff_ts):
+        with self.lock:
+            track = self.tracks.get(door)
+            if track is None:
+                if door in self.evicted or cutoff_ts < self.covered_from: return None
+                return []
+            if cutoff_ts < track.complete_from: return None
+            return track.since(cutoff_ts)
+
+    def warm_from_db(self):
+        """Yeniden başlatma sonrası son dakikaları SQLite'tan belleğe yükler."""
+        if self.warmed: return
+        self.warmed = True
+        if not os.path.exists(HISTORY_DB): return
+
+        cutoff_ts = int(time.time()) - HISTORY_WARM_MINUTES * 60
+        try:
+            with history_read_conn() as conn:
+                rows = read_history_buckets(conn, lambda conn: [
+                    row
+                    for bucket in history_buckets_since(conn, cutoff_ts)
+                    for row in conn.execute(
+                        f"SELECT door_number, latitude, longitude, timestamp FROM {history_table(bucket)} "
+                        f"WHERE timestamp >= ?",
+                        (cutoff_ts,),
+                    )
+                ])
+            rows.sort(key=lambda row: row[3])
+        except Exception as e:
+            print(f"History Warm Error: {e}")
+            return
+
+        with self.lock:
+            self.covered_from = cutoff_ts
+            for track in self.tracks.values():
+                track.complete_from = min(track.complete_from, cutoff_ts)
+        self.add_many(rows)
+
+HISTORY_STORE = HistoryStore(HISTORY_RING_CAPACITY, HISTORY_MEMORY_LIMIT_MB)
+
+# --- SNAPSHOT / DELTA ---
+DOOR_CODE_FIELDS = ("vehicleDoorCode", "busDoorNumber", "doorNumber")
+DOOR_CLEAN_RE = re.compile(r'[^A-Z0-9]')
+
+def vehicle_door(v):
+    return v.get("vehicleDoorCode") or v.get("busDoorNumber")
+
+def normalize_door(code):
+    """Kapı kodunu karşılaştırma için sadeleştirir (b-058 -> B058)."""
+    return DOOR_CLEAN_RE.sub('', str(code or '').upper())
+
+def build_door_index(vehicle_list):
+    """Her yenilemede bir kez kurulan kapı kodu indeksi (monitor'deki 3 alanlı aramanın karşılığı)."""
+    index = {}
+    for field in DOOR_CODE_FIELDS:
+        for v in vehicle_list:
+            key = normalize_door(v.get(field))
+            if key and key not in index:
+                index[key] = v
+    return index
+
+def lookup_vehicle(code):
+    return GLOBAL_CACHE["index"].get(normalize_door(code))
+
+# --- KONUM IZGARASI (harita görünümü / en yakın araçlar) ---
+GRID_CELL_DEG = 0.01          # ~1.1 km enlem
+NEAR_DEFAULT_K = 10
+NEAR_MAX_K = 100
+NEAR_MAX_RADIUS = 50000       # metre
+
+def grid_cell(lat, lng):
+    return int(lat // GRID_CELL_DEG), int(lng // GRID_CELL_DEG)
+
+def build_grid_index(vehicle_list):
+    """Her yenilemede bir kez kurulan sabit boyutlu hücre ızgarası; konumu okunamayanlar atlanır."""
+    grid = {}
     for v in vehicle_list:
-        door = v.get("vehicleDoorCode") or v.get("busDoorNumber")
         try:
             lat = float(v.get("latitude"))
             lng = float(v.get("longitude"))
-            
-            if door and lat and lng:
+        except (TypeError, ValueError):
+            continue
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180) or (lat == 0 and lng == 0): continue
+        grid.setdefault(grid_cell(lat, lng), []).append((lat, lng, v))
+    return grid
+
+def vehicles_in_bbox(south, west, north, east):
+    """Dikdörtgen içindeki araçlar; sadece kesişen hücreler taranır."""
+    ensure_snapshot_parsed()
+    grid = GLOBAL_CACHE["grid"]
+    row0, col0 = grid_cell(south, west)
+    row1, col1 = grid_cell(north, east)
+    matched = []
+    # Geniş bir kutu hücre sayısından fazlaysa doğrudan dolu hücreler gezilir
+    if (row1 - row0 + 1) * (col1 - col0 + 1) > len(grid):
+        cells = (points for (row, col), points in grid.items() if row0 <= row <= row1 and col0 <= col <= col1)
+    else:
+        cells = (grid.get((row, col), ()) for row in range(row0, row1 + 1) for col in range(col0, col1 + 1))
+    for points in cells:
+        for lat, lng, v in points:
+            if south <= lat <= north and west <= lng <= east:
+                matched.append(v)
+    return matched
+
+def nearest_vehicles(lat, lng, k, radius=NEAR_MAX_RADIUS):
+    """(mesafe, araç) listesi, yakından uzağa. Hücre halkaları k araç kesinleşene kadar genişletilir."""
+    ensure_snapshot_parsed()
+    grid = GLOBAL_CACHE["grid"]
+    if not grid: return []
+    row0, col0 = grid_cell(lat, lng)
+    # Bir halka ilerlemek en az bu kadar metre uzaklaşmak demek
+    ring_m = GRID_CELL_DEG * 111320 * max(math.cos(math.radians(min(abs(lat), 89))), 0.01)
+    max_ring = int(radius // ring_m) + 1
+
+    found = []
+    for ring in range(max_ring + 1):
+        for row in range(row0 - ring, row0 + ring + 1):
+            step = 1 if abs(row - row0) == ring else 2 * ring or 1
+            for col in range(col0 - ring, col0 + ring + 1, step):
+                for p_lat, p_lng, v in grid.get((row, col), ()):
+                    distance = calculate_haversine_distance(lat, lng, p_lat, p_lng)
+                    if distance <= radius:
+                        found.append((distance, v))
+        if len(found) >= k:
+            found.sort(key=lambda item: item[0])
+            # Bu halkanın dışındaki bir araç k'ıncıdan daha yakın olamaz
+            if found[k - 1][0] <= ring * ring_m: break
+    found.sort(key=lambda item: item[0])
+    return found[:k]
+
+# --- FİLTRELEME (main.js'teki filterVehicles / isActive / isStale karşılığı) ---
+HALK_LABEL = 'İSTANBUL HALK ULAŞIM TİC.A.Ş'
+
+COMPANY_PRESETS = [
+    ('iett', 'IETT'),
+    ('ozulas', 'OZULAS A.S'),
+    ('halk ulasim', HALK_LABEL),
+    ('mavi marmara', 'MAVI MARMARA'),
+    ('ist halk otobus', 'IST HALK OTOBUS'),
+    ('elit karayolu', 'ELIT KARAYOLU'),
+    ('yeni istanbul ozel halk otobusleri', 'YENI ISTANBUL OHO'),
+    ('oztas', 'OZTAS ULASIM'),
+    ('ist ozel tasimacilik', 'IST OZEL TASIMACILIK'),
+    ('sile', 'SILE OTOBÜSLERII'),
+    ('cift kat', 'CIFT KATLILAR'),
+    ('kentic', 'KENTICI CIFT KATLI'),
+    ('gunaydin', 'GUNAYDIN-CIMEN TUR'),
+    ('bağımsız', HALK_LABEL),
+    ('bagimsiz', HALK_LABEL),
+]
+
+ACTIVE_WINDOW = 300
+STALE_THRESHOLD = 86400
+VEHICLE_FILTER_ARGS = ('operator', 'state', 'stale', 'q', 'fields', 'offset', 'limit')
+SEARCH_CLEAN_RE = re.compile(r'[^a-z0-9]')
+
+COMPANY_NAME_CACHE = {}
+
+def normalize_text(value):
+    text = unicodedata.normalize('NFD', (value or '').lower())
+    return ''.join(ch for ch in text if not unicodedata.combining(ch)).strip()
+
+def map_company_name(name):
+    """Ham operatör adını arayüzdeki şirket etiketine çevirir (sonuç önbelleklenir)."""
+    label = COMPANY_NAME_CACHE.get(name)
+    if label is not None: return label
+
+    raw = (name or '').strip()
+    upper_raw = raw.upper()
+    if 'HALK ULAŞIM' in upper_raw or 'HALK ULASIM' in upper_raw:
+        label = HALK_LABEL
+    else:
+        key = normalize_text(raw)
+        label = next((lbl for match, lbl in COMPANY_PRESETS if normalize_text(match) in key), None)
+        label = label or upper_raw or 'BILINMIYOR'
+
+    COMPANY_NAME_CACHE[name] = label
+    return label
+
+def location_timestamp(v):
+    """Kaydın son konum zamanı (epoch saniye); ingest aşamasında lastLocationTs olarak eklenir."""
+    return v.get('lastLocationTs')
+
+def build_vehicle_attrs(vehicle_list):
+    """Filtrelerin kullandığı alanları yenileme başına bir kez hesaplar."""
+    attrs = []
+    for v in vehicle_list:
+        door = (v.get("vehicleDoorCode") or v.get("busDoorNumber") or '').lower()
+        operator = map_company_name(v.get("operatorType"))
+        attrs.append((v, operator, location_timestamp(v), door, SEARCH_CLEAN_RE.sub('', door), operator.lower()))
+    return attrs
+
+def parse_paging(args):
+    """?offset= ve ?limit= (limit verilmezse None); sayı olmayan veya negatif değerde ValueError."""
+    try:
+        offset = int(args.get('offset') or 0)
+        limit = args.get('limit')
+        limit = int(limit) if limit not in (None, '') else None
+    except ValueError:
+        raise ValueError("offset and limit must be integers")
+    if offset < 0 or (limit is not None and limit < 0):
+        raise ValueError("offset and limit must be non-negative")
+    return offset, limit
+
+def filter_vehicles(args):
+    """Sorgu parametrelerine göre filtrelenmiş (toplam, sayfa) döndürür.
+
+    Geçersiz offset/limit için parse_paging'in ValueError'ı yukarı iletilir.
+    """
+    offset, limit = parse_paging(args)
+    ensure_snapshot_parsed()
+    now = time.time()
+    operator = args.get('operator')
+    state = args.get('state')
+    query = (args.get('q') or '').strip().lower()
+    query_clean = SEARCH_CLEAN_RE.sub('', query)
+
+    # ?stale=1/true/yes: STALE_THRESHOLD, ?stale=0/false/no: filtre yok, diğer sayılar: saniye eşiği
+    stale = args.get('stale')
+    if stale is not None:
+        flag = stale.strip().lower()
+        if flag in ('1', 'true', 'yes'):
+            stale = STALE_THRESHOLD
+        elif flag in ('', '0', 'false', 'no'):
+            stale = None
+        else:
+            try:
+                stale = int(flag)
+            except ValueError:
+                stale = None
+
+    matched = []
+    for v, op, ts, door, door_clean, op_lower in GLOBAL_CACHE["attrs"]:
+        if operator and op != operator: continue
+        if state:
+            active = ts is not None and abs(now - ts) < ACTIVE_WINDOW
+            if (state == 'active') != active: continue
+        if stale is not None and (ts is None or now - ts < stale): continue
+        if query and not (query in door or (query_clean and query_clean in door_clean) or query in op_lower): continue
+        matched.append(v)
+
+    total = len(matched)
+    matched = matched[offset:offset + limit] if limit is not None else matched[offset:]
+
+    fields = [f.strip() for f in (args.get('fields') or '').split(',') if f.strip()]
+    if fields:
+        matched = [{f: v[f] for f in fields if f in v} for v in matched]
+
+    return total, matched
+
+class FleetSummary:
+    """Sayaç panoları için filo özeti; her yenilemede sadece değişen/silinen kapılarla güncellenir.
+
+    Aktif/pasif/bayat sayıları zamanla değiştiği için konum zamanları sıralı tutulur ve sayım
+    istek anında ikili aramayla yapılır.
+    """
+
+    def __init__(self):
+        self.entries = {}      # kapı -> (şirket etiketi, konum zamanı veya None)
+        self.operators = {}
+        self.timestamps = []   # sıralı konum zamanları
+        self.no_signal = 0
+        self.lock = threading.Lock()
+
+    def remove(self, door):
+        entry = self.entries.pop(door, None)
+        if entry is None: return
+        operator, ts = entry
+        count = self.operators[operator] - 1
+        if count: self.operators[operator] = count
+        else: del self.operators[operator]
+        if ts is None:
+            self.no_signal -= 1
+        else:
+            del self.timestamps[bisect_left(self.timestamps, ts)]
+
+    def add(self, door, v):
+        operator = map_company_name(v.get("operatorType"))
+        ts = location_timestamp(v)
+        self.entries[door] = (operator, ts)
+        self.operators[operator] = self.operators.get(operator, 0) + 1
+        if ts is None:
+            self.no_signal += 1
+        else:
+            insort(self.timestamps, ts)
+
+    def apply(self, changed, removed, records):
+        with self.lock:
+            for door in removed:
+                self.remove(door)
+            for door in changed:
+                self.remove(door)
+                self.add(door, records[door])
+
+    def report(self, now):
+        with self.lock:
+            timestamps = self.timestamps
+            total = len(self.entries)
+            active = bisect_left(timestamps, now + ACTIVE_WINDOW) - bisect_right(timestamps, now - ACTIVE_WINDOW)
+            return {
+                "total": total,
+                "active": active,
+                "inactive": total - active,
+                "stale": bisect_right(timestamps, now - STALE_THRESHOLD),
+                "signalLost": bisect_right(timestamps, now - SIGNAL_LOST_MINUTES * 60),
+                "noSignal": self.no_signal,
+                "operators": dict(sorted(self.operators.items())),
+            }
+
+FLEET_SUMMARY = FleetSummary()
+
+def diff_snapshot(vehicle_list, now):
+    """Yeni listeyi bir öncekiyle karşılaştırır.
+
+    Dönüş: (değişen kapılar, kaybolan kapılar, DB'ye yazılacak konum kayıtları).
+    Delta beslemesi ve geçmiş kaydı aynı geçişten üretilir.
+    """
+    changed = []
+    moved = []
+    seen = set()
+
+    for v in vehicle_list:
+        door = vehicle_door(v)
+        if not door: continue
+        seen.add(door)
+
+        # Kayıttaki herhangi bir alan değiştiyse istemciye gönderilecek
+        if LAST_KNOWN_RECORDS.get(door) != v:
+            changed.append(door)
+            LAST_KNOWN_RECORDS[door] = v
+
+        try:
+            lat = float(v.get("latitude"))
+            lng = float(v.get("longitude"))
+
+            if lat and lng:
                 # Kontrol: Araç konumu değişti mi?
                 last_loc = LAST_KNOWN_LOCATIONS.get(door)
-                
+
                 # Eğer ilk kez görüyorsak veya konum değişmişse kaydet
                 if not last_loc or (last_loc[0] != lat or last_loc[1] != lng):
-                    new_records.append((door, lat, lng, now))
+                    moved.append((door, lat, lng, now))
                     LAST_KNOWN_LOCATIONS[door] = (lat, lng)
-                    
-        except:
+
+        except (TypeError, ValueError):
             continue
-            
-    if new_records:
-        try:
-            with sqlite3.connect(HISTORY_DB) as conn:
-                cur = conn.cursor()
-                cur.executemany("INSERT INTO history (door_number, latitude, longitude, timestamp) VALUES (?, ?, ?, ?)", new_records)
-                conn.commit()
-                # print(f"[DB] {len(new_records)} updates saved.") 
-        except Exception as e:
-            print(f"DB Write Error: {e}")
+
+    removed = [door for door in LAST_KNOWN_RECORDS if door not in seen]
+    for door in removed:
+        del LAST_KNOWN_RECORDS[door]
+
+    return changed, removed, moved
+
+def publish_snapshot(data, now=None, body=None, source="live"):
+    """Yeni filo listesini GLOBAL_CACHE'e yazar ve değiştiyse sürümü artırır.
+
+    Kalıcı dosyadan yüklenirken (source="persisted") zaman dosyanınki, JSON gövdesi hazırdır ve
+    konumlar geçmişe yazılmaz (geçmiş dosyadan ayrıca yüklenir).
+    """
+    now = now or time.time()
+    index = build_door_index(data)
+    attrs = build_vehicle_attrs(data)
+    grid = build_grid_index(data)
+    with SNAPSHOT_LOCK:
+        with METRICS.stage("diff"):
+            changed, removed, moved = diff_snapshot(data, int(now))
+        FLEET_SUMMARY.apply(changed, removed, LAST_KNOWN_RECORDS)
+        if changed or removed:
+            version = GLOBAL_CACHE["version"] + 1
+            SNAPSHOT_CHANGELOG.append((version, changed, removed))
+            GLOBAL_CACHE["version"] = version
+            # İçerik değişmediyse önceki gövde ve sıkıştırılmış halleri geçerli kalır
+            GLOBAL_CACHE["encoded"] = {"etag": f"{SNAPSHOT_EPOCH}-{version}", "identity": body or orjson.dumps(data)}
+        GLOBAL_CACHE["data"] = data
+        GLOBAL_CACHE["size"] = len(data)
+        GLOBAL_CACHE["source"] = source
+        GLOBAL_CACHE["index"] = index
+        GLOBAL_CACHE["attrs"] = attrs
+        GLOBAL_CACHE["grid"] = grid
+        GLOBAL_CACHE["last_update"] = now
+
+    if changed or removed:
+        with STREAM_COND:
+            STREAM_COND.notify_all()
+
+    if source == "live":
+        HISTORY_STORE.add_many(moved)
+        save_data_to_db(moved)
+        # Hareket tabanı canlı örneklerden kurulur; kalıcı görüntüde ilk canlı yenilemeyi bekler
+        with METRICS.stage("fleet_status"):
+            FLEET_STATUS.update(data, now)
+    return GLOBAL_CACHE["version"]
+
+def snapshot_record(door):
+    """Delta için kapının güncel kaydı (vehicle_door anahtarıyla); yoksa None."""
+    index = GLOBAL_CACHE["index"]
+    if isinstance(index, SharedIndex):
+        return index.by_door(door)
+    return LAST_KNOWN_RECORDS.get(door)
+
+def build_delta(since, epoch=None):
+    """since sürümünden bu yana eklenen/değişen/silinen araçları döner.
+
+    since None ise, günlük o kadar eskiye gitmiyorsa veya epoch uyuşmuyorsa tam liste gönderilir;
+    tam listede kayıtlar yerine hazır gövde ("body") döner, delta_body onu olduğu gibi ekler.
+    """
+    with SNAPSHOT_LOCK:
+        version = GLOBAL_CACHE["version"]
+        log = list(SNAPSHOT_CHANGELOG)
+
+        full = (
+            since is None
+            or (epoch and epoch != SNAPSHOT_EPOCH)
+            or since > version
+            or (since < version and (not log or log[0][0] > since + 1))
+        )
+        if full:
+            return {
+                "epoch": SNAPSHOT_EPOCH,
+                "version": version,
+                "full": True,
+                "body": GLOBAL_CACHE["encoded"]["identity"],
+            }
+
+        touched = set()
+        for entry_version, changed, removed in log:
+            if entry_version > since:
+                touched.update(changed)
+                touched.update(removed)
+
+        changed_records = []
+        removed_doors = []
+        for door in touched:
+            record = snapshot_record(door)
+            if record is None:
+                removed_doors.append(door)
+            else:
+                changed_records.append(record)
+
+    return {
+        "epoch": SNAPSHOT_EPOCH,
+        "version": version,
+        "full": False,
+        "changed": changed_records,
+        "removed": removed_doors,
+    }
+
+def orjson_response(payload, status=200):
+    return app.response_class(orjson.dumps(payload), status=status, mimetype='application/json')
+
+# --- HAZIR GÖVDE / ETAG ---
+def encoded_body(encoded, encoding):
+    """Sürümün gövdesini istenen kodlamayla döner; her kodlama sürüm başına bir kez sıkıştırılır."""
+    cached = encoded.get(encoding)
+    if cached is None:
+        with ENCODE_LOCK:
+            cached = encoded.get(encoding)
+            if cached is None:
+                if encoding == 'br':
+                    cached = brotli.compress(encoded["identity"], quality=BROTLI_QUALITY)
+                else:
+                    cached = gzip.compress(encoded["identity"], compresslevel=GZIP_LEVEL)
+                encoded[encoding] = cached
+    return cached
+
+def body_response(body, **kwargs):
+    """Hazır gövdeden yanıt; paylaşılan nesil dosyasındaki memoryview'lar kopyalanmadan verilir."""
+    if isinstance(body, memoryview):
+        response = app.response_class([body], **kwargs)
+        response.content_length = len(body)
+        return response
+    return app.response_class(body, **kwargs)
+
+def snapshot_response():
+    """Tam filo listesini hazır byte'lardan sunar; ETag eşleşirse 304 döner."""
+    # ETag, gövde ve sıkıştırılmış haller aynı sözlükte; yayınlama sırasında birlikte değişir
+    encoded = GLOBAL_CACHE["encoded"]
+    etag = encoded["etag"] or f"{SNAPSHOT_EPOCH}-0"
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    offers = ['br', 'gzip'] if brotli else ['gzip']
+    encoding = request.accept_encodings.best_match(offers) or 'identity'
+
+    response = body_response(encoded_body(encoded, encoding), mimetype='application/json')
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.set_etag(etag)
+    return response
+
+def delta_body(delta):
+    """Delta JSON'u; tam senkronda liste hazır gövdeden eklenir, tekrar serileştirilmez."""
+    if not delta["full"]:
+        return orjson.dumps(delta)
+    head = orjson.dumps({"epoch": delta["epoch"], "version": delta["version"], "full": True, "removed": []})
+    return head[:-1] + b',"changed":' + delta["body"] + b'}'
+
+def delta_response(delta):
+    return app.response_class(delta_body(delta), mimetype='application/json')
 
 # --- İETT FONKSİYONLARI ---
+TR_UTC_OFFSET = 3 * 3600
+DAY_EPOCH_CACHE = {}
+CLOCK_SECONDS_CACHE = {}
+TR_DATE_CACHE = {}
+TR_CLOCK_CACHE = {}
+
+def day_epoch(date_str):
+    """'2025-12-14T00:00:00' -> o günün UTC gece yarısı (epoch). Okunamazsa None."""
+    day = DAY_EPOCH_CACHE.get(date_str)
+    if day is None:
+        if len(DAY_EPOCH_CACHE) > 1000: DAY_EPOCH_CACHE.clear()
+        try:
+            day = calendar.timegm(datetime.strptime(date_str[:10], "%Y-%m-%d").timetuple())
+        except (TypeError, ValueError):
+            day = False
+        DAY_EPOCH_CACHE[date_str] = day
+    return day if day is not False else None
+
+def clock_seconds(time_str):
+    """'15:03:11' -> gün içindeki saniye. Okunamazsa None."""
+    seconds = CLOCK_SECONDS_CACHE.get(time_str)
+    if seconds is None:
+        if len(CLOCK_SECONDS_CACHE) > 100000: CLOCK_SECONDS_CACHE.clear()
+        try:
+            h, m, sec = (int(part) for part in time_str.split(':'))
+            seconds = h * 3600 + m * 60 + sec if 0 <= h < 24 and 0 <= m < 60 and 0 <= sec < 60 else False
+        except (AttributeError, ValueError):
+            seconds = False
+        CLOCK_SECONDS_CACHE[time_str] = seconds
+    return seconds if seconds is not False else None
+
+def tr_date_str(day):
+    text = TR_DATE_CACHE.get(day)
+    if text is None:
+        if len(TR_DATE_CACHE) > 1000: TR_DATE_CACHE.clear()
+        text = TR_DATE_CACHE[day] = time.strftime("%Y-%m-%dT00:00:00", time.gmtime(day))
+    return text
+
+def tr_clock_str(seconds):
+    text = TR_CLOCK_CACHE.get(seconds)
+    if text is None:
+        text = TR_CLOCK_CACHE[seconds] = f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+    return text
+
 def fix_timezone_data(data_list):
-    """API'den gelen UTC verileri UTC+3 (Istanbul) saatine çevirir."""
+    """API'den gelen UTC verileri UTC+3 (Istanbul) saatine çevirir ve lastLocationTs (epoch) ekler.
+
+    Kayıtlar yerinde güncellenir; tarih ve saat parçaları ayrı ayrı önbelleklendiği için
+    yenileme başına maliyet birkaç sözlük aramasıdır.
+    """
     if not data_list: return []
-    fixed = []
-    for item in data_list:
-        v = item.copy()
+    for v in data_list:
         date_str = v.get('lastLocationDate')
         time_str = v.get('lastLocationTime')
-        
-        if date_str and time_str:
-            try:
-                # Formatlar: 2025-12-14T00:00:00 ve 15:03:11
-                clean_date = date_str[:10] 
-                full_str = f"{clean_date} {time_str}"
-                
-                # UTC varsayarak parse et
-                dt_utc = datetime.strptime(full_str, "%Y-%m-%d %H:%M:%S")
-                # 3 saat ekle
-                dt_tr = dt_utc + timedelta(hours=3)
-                
-                # geri yaz
-                v['lastLocationDate'] = dt_tr.strftime("%Y-%m-%dT00:00:00")
-                v['lastLocationTime'] = dt_tr.strftime("%H:%M:%S")
-            except:
-                pass
-        fixed.append(v)
-    return fixed
+        if not date_str or not time_str: continue
+
+        # Formatlar: 2025-12-14T00:00:00 ve 15:03:11 (UTC)
+        day = day_epoch(date_str)
+        seconds = clock_seconds(time_str)
+        if day is None or seconds is None: continue
+
+        ts = day + seconds
+        local = ts + TR_UTC_OFFSET
+        local_seconds = local % 86400
+        v['lastLocationDate'] = tr_date_str(local - local_seconds)
+        v['lastLocationTime'] = tr_clock_str(local_seconds)
+        v['lastLocationTs'] = ts
+    return data_list
 
 def get_pubkey(session):
     if GLOBAL_CACHE["pubkey"]: return GLOBAL_CACHE["pubkey"]
     try:
-        resp = session.get(PUBKEY_URL, timeout=4, verify=False)
+        with METRICS.stage("pubkey"):
+            resp = session.get(PUBKEY_URL, timeout=4, verify=False)
         if resp.status_code != 200: return None
         key_data = resp.json().get("key")
         if "-----BEGIN" not in key_data:
@@ -174,101 +1347,378 @@ def get_pubkey(session):
         print(f"Pubkey Error: {e}")
         return None
 
-def fetch_from_iett_internal():
-    try:
-        with requests.Session() as session:
-            pub_key = get_pubkey(session)
-            if not pub_key: return []
-
-            # Şifreleme
-            aes_key = get_random_bytes(32)
-            rsa_key = RSA.import_key(pub_key)
-            cipher = PKCS1_OAEP.new(rsa_key, hashAlgo=SHA256)
-            enc_key_b64 = base64.b64encode(cipher.encrypt(aes_key)).decode("ascii")
-
-            # İstek
-            payload = {"encKey": enc_key_b64}
-            resp = session.post(DATA_URL, headers=HEADERS, json=payload, timeout=8, verify=False)
-            
-            if resp.status_code != 200:
+# --- IETT İSTEMCİSİ ---
+class UpstreamClient:
+    """Filo ve görev istekleri için paylaşılan IETT istemcisi.
+
+    Keep-alive bağlantı havuzu, parse edilmiş RSA anahtarı ve şifrelenmiş AES oturum anahtarı
+    istekler arasında yeniden kullanılır. Oturum anahtarı reddedilince (KEY_REJECT_STATUSES veya
+    GCM etiket hatası) yenilenir, üst üste reddedilirse pubkey de yeniden çekilir; kapıya özel
+    404 veya ağ zaman aşımı anahtara dokunmaz. requests ve pycryptodome ilk IETT isteğinde yüklenir;
+    kalıcı anlık görüntüyle açılan süreçte ilk yanıtın önüne girmezler.
+    """
+
+    # Bu kadar ardışık hatadan sonra pubkey yenilenir
+    PUBKEY_ROTATE_AFTER = 2
+    # IETT encKey'i çözemediğinde dönen durumlar (fake_upstream'de 500)
+    KEY_REJECT_STATUSES = frozenset((400, 401, 403, 500))
+
+    def __init__(self, pool_size=16):
+        self.pool_size = pool_size
+        self.lock = threading.Lock()
+        self.cipher = None        # PKCS1_OAEP nesnesi (güncel pubkey için)
+        self.session_key = None   # (aes_key, enc_key_b64)
+        self.session_key_uses = 0
+        self.failures = 0
+        # Süreç boyunca pubkey yenileme sayısı, yolu tetikleyen isteğe göre (devre kesici fleet'i okur)
+        self.pubkey_rotations = {"fleet": 0, "tasks": 0}
+
+    @cached_property
+    def session(self):
+        import requests
+        import urllib3
+
+        # SSL Uyarılarını Kapat
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=self.pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _get_session_key(self):
+        from Crypto.Cipher import PKCS1_OAEP
+        from Crypto.Hash import SHA256
+        from Crypto.PublicKey import RSA
+        from Crypto.Random import get_random_bytes
+
+        with self.lock:
+            if self.session_key:
+                self.session_key_uses += 1
+                return self.session_key, self.session_key_uses > 1
+
+            pub_key = get_pubkey(self.session)
+            if not pub_key: return None, False
+
+            with METRICS.stage("rsa_encrypt"):
+                if self.cipher is None:
+                    self.cipher = PKCS1_OAEP.new(RSA.import_key(pub_key), hashAlgo=SHA256)
+
+                aes_key = get_random_bytes(32)
+                enc_key_b64 = base64.b64encode(self.cipher.encrypt(aes_key)).decode("ascii")
+            self.session_key = (aes_key, enc_key_b64)
+            self.session_key_uses = 1
+            return self.session_key, False
+
+    def _on_failure(self, session_key, kind):
+        with self.lock:
+            # Başka bir thread anahtarı zaten yenilediyse tekrar sayma
+            if self.session_key is not session_key: return
+            self.session_key = None
+            self.failures += 1
+            if self.failures >= self.PUBKEY_ROTATE_AFTER:
+                METRICS.inc("iett_pubkey_rotations_total", kind=kind)
+                self.pubkey_rotations[kind] += 1
+                self.cipher = None
                 GLOBAL_CACHE["pubkey"] = None
-                return []
+                self.failures = 0
+
+    def _on_success(self):
+        self.failures = 0
 
-            data_json = resp.json()
+    def post_encrypted(self, url, timeout=8, retry=True):
+        """encKey ile POST edip yanıtı çözer ve parse eder.
+
+        Yanıtta veri yoksa None döner; HTTP/şifre çözme hatalarında exception fırlatır.
+        Yeniden kullanılan oturum anahtarı reddedilirse yeni anahtarla en fazla bir kez daha denenir.
+        """
+        session_key, reused = self._get_session_key()
+        if not session_key:
+            raise RuntimeError("Pubkey alınamadı")
+
+        aes_key, enc_key_b64 = session_key
+        kind = "fleet" if url == DATA_URL else "tasks"
+        rejected = False
+        try:
+            with METRICS.stage("upstream_post", kind):
+                resp = self.session.post(url, headers=HEADERS, json={"encKey": enc_key_b64}, timeout=timeout, verify=False)
+                if resp.status_code != 200:
+                    rejected = resp.status_code in self.KEY_REJECT_STATUSES
+                    raise RuntimeError(f"HTTP {resp.status_code}")
+
+                data_json = resp.json()
+            if not data_json or "data" not in data_json:
+                self._on_success()
+                return None
 
             # Çözme
-            iv = base64.b64decode(data_json.get("iv"))
-            full_data = base64.b64decode(data_json.get("data"))
-            tag = full_data[-16:]      
-            ciphertext = full_data[:-16] 
-            
-            cipher_aes = AES.new(aes_key, AES.MODE_GCM, nonce=iv)
-            plaintext = cipher_aes.decrypt_and_verify(ciphertext, tag)
-            
-            try:
-                # OPTIMIZATION: Use orjson
-                final_data = orjson.loads(plaintext)
-            except:
-                return []
+            with METRICS.stage("aes_decrypt", kind):
+                iv = base64.b64decode(data_json.get("iv"))
+                full_data = base64.b64decode(data_json.get("data"))
+                tag = full_data[-16:]
+                ciphertext = full_data[:-16]
+
+                from Crypto.Cipher import AES
+                cipher_aes = AES.new(aes_key, AES.MODE_GCM, nonce=iv)
+                try:
+                    plaintext = cipher_aes.decrypt_and_verify(ciphertext, tag)
+                except ValueError:
+                    # Etiket tutmadı: yanıt başka bir anahtarla şifrelenmiş
+                    rejected = True
+                    raise
+        except Exception:
+            METRICS.inc("iett_upstream_errors_total", kind=kind)
+            if not rejected: raise
+            self._on_failure(session_key, kind)
+            if reused and retry:
+                METRICS.inc("iett_upstream_retries_total", kind=kind)
+                return self.post_encrypted(url, timeout, retry=False)
+            raise
+
+        self._on_success()
+        # OPTIMIZATION: Use orjson
+        with METRICS.stage("json_parse", kind):
+            return orjson.loads(plaintext)
+
+UPSTREAM = UpstreamClient()
+
+def fetch_from_iett_internal():
+    try:
+        final_data = UPSTREAM.post_encrypted(DATA_URL)
+        if not final_data: return []
+
+        result_list = []
+        if isinstance(final_data, dict):
+            result_list = final_data.get('data') or final_data.get('buses') or []
+        else:
+            result_list = final_data
             
-            result_list = []
-            if isinstance(final_data, dict):
-                result_list = final_data.get('data') or final_data.get('buses') or []
-            else:
-                result_list = final_data
-                
-            # Saat Düzeltmesi (UTC -> TRT)
+        # Saat Düzeltmesi (UTC -> TRT)
+        with METRICS.stage("normalize"):
             result_list = fix_timezone_data(result_list)
-            
-            return result_list
+        
+        return result_list
 
     except Exception as e:
         print(f"Fetch Error: {e}")
         return []
 
+# --- YOKLAMA ZAMANLAYICISI (değişim hızı + talep + devre kesici) ---
+POLL_MIN_INTERVAL = float(os.getenv('POLL_MIN_INTERVAL', CACHE_DURATION))
+POLL_MAX_INTERVAL = float(os.getenv('POLL_MAX_INTERVAL', 15))
+# Bu kadar saniyedir veri isteyen istemci yoksa boşta aralığına çıkılır (gece yükü)
+POLL_IDLE_AFTER = float(os.getenv('POLL_IDLE_AFTER', 120))
+POLL_IDLE_INTERVAL = float(os.getenv('POLL_IDLE_INTERVAL', 60))
+# Aralık, yoklama başına filonun yaklaşık bu oranı değişecek şekilde seçilir
+POLL_TARGET_CHANGE = 0.05
+POLL_RATE_SMOOTHING = 0.3
+# Her beklemeye ±%15 jitter (birden çok kurulum IETT'ye aynı anda yüklenmesin)
+POLL_JITTER = 0.15
+POLL_DECISION_LOG = 50
+# Okuyucu süreçler talebi en fazla bu sıklıkta paylaşılan dizindeki dosyaya yansıtır
+POLL_DEMAND_TOUCH = 5
+# Devre kesici: üst üste hata veya pencere içinde tekrarlanan pubkey yenilemesi
+BREAKER_FAILURES = int(os.getenv('BREAKER_FAILURES', 5))
+BREAKER_PUBKEY_ROTATIONS = 3
+BREAKER_WINDOW = 300
+BREAKER_OPEN_SECONDS = 30
+BREAKER_MAX_OPEN_SECONDS = 600
+
+class PollScheduler:
+    """Background worker'ın IETT filo yoklama aralığını seçer ve yoklamayı devre kesiciyle korur.
+
+    Aralık ardışık anlık görüntüler arasında ölçülen değişim hızından (saniyede değişen filo oranı,
+    EWMA) hesaplanır; yakın zamanda veri isteyen yoksa boşta aralığı kullanılır, boştayken gelen ilk
+    istek beklemeyi keser. Açık devrede refresh_snapshot IETT'ye gitmez, süre dolunca tek deneme
+    yapılır (yarı açık); deneme de başarısızsa açık kalma süresi ikiye katlanır.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.state = "closed"           # closed / open / half_open
+        self.open_until = 0.0
+        self.open_seconds = BREAKER_OPEN_SECONDS
+        self.failures = 0
+        self.rotations = deque()        # pencere içindeki pubkey yenileme zamanları
+        self.seen_rotations = 0
+        self.rate = None                # saniyede değişen filo oranı (EWMA)
+        self.last_success = None
+        self.last_demand = time.time()
+        self.last_touch = 0.0
+        self.idle = False
+        self.decision = None
+        self.decisions = deque(maxlen=POLL_DECISION_LOG)
+
+    @property
+    def demand_path(self):
+        return os.path.join(SHARED_SNAPSHOT_DIR, "demand")
+
+    @property
+    def report_path(self):
+        return os.path.join(SHARED_SNAPSHOT_DIR, "scheduler.json")
+
+    def note_demand(self):
+        """İstemci veri istedi (refresh_if_stale); okuyucu süreçte fetcher'a dosya ile bildirilir."""
+        now = time.time()
+        self.last_demand = now
+        if PROCESS_ROLE == "reader" and now - self.last_touch >= POLL_DEMAND_TOUCH:
+            self.last_touch = now
+            try:
+                with open(self.demand_path, "ab"): pass
+                os.utime(self.demand_path)
+            except OSError:
+                pass
+        if self.idle:
+            self.wake.set()
+
+    def demand_age(self, now):
+        last = self.last_demand
+        if PROCESS_ROLE == "fetcher":
+            try:
+                last = max(last, os.path.getmtime(self.demand_path))
+            except OSError:
+                pass
+        return now - last
+
+    def allow_attempt(self):
+        """Açık devrede False; açık kalma süresi dolduysa yarı açığa geçip tek denemeye izin verir."""
+        with self.lock:
+            if self.state != "open": return True
+            if time.time() < self.open_until: return False
+            self.state = "half_open"
+            return True
+
+    def _trip(self, cause, now):
+        if self.state == "half_open":
+            self.open_seconds = min(self.open_seconds * 2, BREAKER_MAX_OPEN_SECONDS)
+        self.state = "open"
+        self.open_until = now + self.open_seconds
+        METRICS.inc("iett_breaker_trips_total", cause=cause)
+        print(f"[POLL] Circuit open ({cause}), next attempt in {self.open_seconds:.0f}s")
+
+    def record(self, ok, changed=0, size=0):
+        """Yenileme sonucunu işler: değişim hızı, ardışık hata ve pubkey yenilemesi sayılır."""
+        now = time.time()
+        with self.lock:
+            # Görev isteklerinin yenilemeleri filo yoklamasını kesmez
+            rotations = UPSTREAM.pubkey_rotations["fleet"]
+            self.rotations.extend([now] * (rotations - self.seen_rotations))
+            self.seen_rotations = rotations
+            while self.rotations and self.rotations[0] < now - BREAKER_WINDOW:
+                self.rotations.popleft()
+
+            if ok:
+                if self.last_success is not None and size and now > self.last_success:
+                    sample = changed / size / (now - self.last_success)
+                    self.rate = sample if self.rate is None else (
+                        POLL_RATE_SMOOTHING * sample + (1 - POLL_RATE_SMOOTHING) * self.rate
+                    )
+                self.last_success = now
+                self.failures = 0
+                if self.state != "closed":
+                    print("[POLL] Circuit closed")
+                self.state = "closed"
+                self.open_seconds = BREAKER_OPEN_SECONDS
+            else:
+                self.failures += 1
+                if self.state == "half_open":
+                    self._trip("probe", now)
+                elif self.state == "closed" and self.failures >= BREAKER_FAILURES:
+                    self._trip("errors", now)
+                elif self.state == "closed" and len(self.rotations) >= BREAKER_PUBKEY_ROTATIONS:
+                    self.rotations.clear()
+                    self._trip("pubkey", now)
+
+    def next_interval(self):
+        """Bir sonraki yoklamaya kadar beklenecek süreyi seçer; karar kaydedilir ve raporlanır."""
+        now = time.time()
+        demand_age = self.demand_age(now)
+        with self.lock:
+            if self.state == "open":
+                interval, reason = max(0.0, self.open_until - now), "breaker_open"
+            elif self.failures:
+                interval, reason = min(30, 5 + self.failures * 2), "failure_backoff"
+            else:
+                if self.rate:
+                    interval = POLL_TARGET_CHANGE / self.rate
+                else:
+                    # Henüz ölçüm yok: en sık; hiç değişim ölçülmediyse en seyrek
+                    interval = POLL_MIN_INTERVAL if self.rate is None else POLL_MAX_INTERVAL
+                interval, reason = min(max(interval, POLL_MIN_INTERVAL), POLL_MAX_INTERVAL), "change_rate"
+                if demand_age > POLL_IDLE_AFTER:
+                    interval, reason = max(interval, POLL_IDLE_INTERVAL), "idle"
+            interval *= 1 + random.uniform(-POLL_JITTER, POLL_JITTER)
+            self.idle = reason == "idle"
+            self.decision = {
+                "at": round(now, 3),
+                "interval": round(interval, 3),
+                "reason": reason,
+                "changeRate": None if self.rate is None else round(self.rate, 6),
+                "demandAge": round(demand_age, 1),
+                "breaker": self.state,
+                "failures": self.failures,
+            }
+            self.decisions.append(self.decision)
+            failures = self.failures
+
+        METRICS.inc("iett_poll_decisions_total", reason=reason)
+        REFRESH_STATE["consecutive_errors"] = failures
+        REFRESH_STATE["backoff_seconds"] = round(interval, 3) if reason in ("failure_backoff", "breaker_open") else 0
+        if reason in ("failure_backoff", "breaker_open"):
+            METRICS.inc("iett_refresh_backoff_total")
+        if PROCESS_ROLE == "fetcher":
+            # Okuyucular /api/poll-scheduler için fetcher'ın kararlarını bu dosyadan sunar
+            try:
+                tmp_path = f"{self.report_path}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(orjson.dumps(self.report()))
+                os.replace(tmp_path, self.report_path)
+            except OSError as e:
+                print(f"Scheduler report error: {e}")
+        return interval
+
+    def sleep(self, interval):
+        """Aralık kadar bekler; boştayken talep gelirse (okuyuculardan dosya ile de) erken uyanır."""
+        self.wake.clear()
+        deadline = time.monotonic() + interval
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0: return
+            if self.wake.wait(min(remaining, 1.0)): return
+            if self.idle and self.demand_age(time.time()) < POLL_IDLE_AFTER: return
+
+    def report(self):
+        with self.lock:
+            return {
+                "breaker": self.state,
+                "openUntil": round(self.open_until, 3) if self.state == "open" else None,
+                "failures": self.failures,
+                "pubkeyRotations": len(self.rotations),
+                "changeRate": None if self.rate is None else round(self.rate, 6),
+                "decision": self.decision,
+                "decisions": list(self.decisions),
+            }
+
+POLL_SCHEDULER = PollScheduler()
+
 def background_worker():
-    print("Background fetcher started (Optimized)...")
-    error_count = 0 
+    print("Background fetcher started (adaptive)...")
     while True:
         try:
-            data = fetch_from_iett_internal()
-            if data:
-                GLOBAL_CACHE["data"] = data
-                GLOBAL_CACHE["last_update"] = time.time()
-                save_data_to_db(data)
-                error_count = 0 # Sıfırla
-                time.sleep(1.5)
-            else:
-                # Backoff Logic
-                error_count += 1
-                wait_time = min(30, 5 + error_count * 2) 
-                print(f"Data empty. Waiting {wait_time}s...")
-                time.sleep(wait_time)
+            refresh_snapshot(wait=True)
         except Exception as e:
+            # Sonuç refresh_snapshot içinde hata olarak kaydedildi
             print(f"Background Loop Error: {e}")
-            error_count += 1
-            time.sleep(10)
+        POLL_SCHEDULER.sleep(POLL_SCHEDULER.next_interval())
 
 def cleanup_worker():
-    print("DB Cleanup worker started (Runs every 5 min, keeps last 10 min)...")
+    print(f"DB Cleanup worker started (Runs every 1 min, keeps last {HISTORY_RETENTION_MINUTES} min)...")
     while True:
         try:
-            time.sleep(300) # 5 Dakika (Daha sık temizle)
-            
-            # Sadece son 10 dakikayı tut (600 saniye)
-            cutoff = int(time.time()) - 600
-            
-            with sqlite3.connect(HISTORY_DB) as conn:
-                cur = conn.cursor()
-                cur.execute("DELETE FROM history WHERE timestamp < ?", (cutoff,))
-                deleted = cur.rowcount
-                conn.commit()
-                if deleted > 0:
-                    print(f"[CLEANUP] Deleted {deleted} old records.")
-                    # Veritabanı boyutunu fiziksel olarak küçült
-                    if deleted > 5000:
-                        cur.execute("VACUUM")
-
+            time.sleep(60)
+            # Süresi dolan zaman dilimlerini yazıcı thread düşürür (DROP TABLE, VACUUM yok)
+            HISTORY_WRITER.submit_command("expire")
         except Exception as e:
             print(f"Cleanup Error: {e}")
             time.sleep(60)
@@ -278,99 +1728,599 @@ def cleanup_worker():
 def fetch_from_iett():
     return fetch_from_iett_internal()
 
+# --- BÖLÜMLÜ DOSYA (kalıcı anlık görüntü ve paylaşılan nesiller) ---
+# Dosya düzeni: MAGIC | başlık uzunluğu (u32) | JSON başlık | bölümler. Bölüm yerleri başlığın
+# "sections" alanında, başlık sonrasına göre ve 8 bayta hizalı; sütunlar mmap üzerinden kopyasız okunur.
+def write_section_file(path, magic, header, sections, durable=True):
+    """Başlık ve bölümleri geçici dosyaya yazıp atomik olarak taşır."""
+    spans, offset = [], 0
+    for part in sections:
+        spans.append([offset, len(part)])
+        offset += -(-len(part) // 8) * 8
+    header_bytes = orjson.dumps({**header, "sections": spans})
+
+    # Aynı süreçteki eşzamanlı yazıcılar birbirinin geçici dosyasını ezmesin
+    tmp_path = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+    with open(tmp_path, "wb") as f:
+        f.write(magic + len(header_bytes).to_bytes(4, "little") + header_bytes)
+        base = -(-f.tell() // 8) * 8
+        for (offset, _), part in zip(spans, sections):
+            f.write(b"\0" * (base + offset - f.tell()))
+            f.write(part)
+        f.flush()
+        if durable: os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def read_section_file(path, magic):
+    """(başlık, bölümler); bölümler dosyanın mmap'i üzerinde memoryview, kopyalanmaz.
+
+    mmap açıkça kapatılmaz: gövdeyi tutan yanıtlar bitince referanslarla birlikte serbest kalır.
+    """
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mm[:len(magic)] != magic:
+        raise ValueError("bad magic")
+    start = len(magic) + 4
+    end = start + int.from_bytes(mm[len(magic):start], "little")
+    header = orjson.loads(mm[start:end])
+    base = -(-end // 8) * 8
+    view = memoryview(mm)
+    return header, [view[base + offset:base + offset + length] for offset, length in header["sections"]]
+
+# --- KALICI ANLIK GÖRÜNTÜ (soğuk başlangıç) ---
+# Bölümler: filo gövdesi (/api/veriler'in aynısı) | geçmiş sütunları (lat f8, lng f8, ts i8)
+SNAPSHOT_FILE = os.getenv('SNAPSHOT_FILE') or HISTORY_DB + '.snapshot'
+SNAPSHOT_MAGIC = b"IETTSNP1"
+SNAPSHOT_SAVE_INTERVAL = float(os.getenv('SNAPSHOT_SAVE_INTERVAL', 15))
+SNAPSHOT_SAVE_STATE = {"last_save": 0.0, "pending": False, "lock": threading.Lock()}
+
+def snapshot_history_columns(cutoff_ts):
+    """Bellekteki son dakikalar: (kapılar, kapı başına nokta sayısı, lat, lng, ts dizileri)."""
+    doors, counts, lat, lng, ts = [], [], array("d"), array("d"), array("q")
+    with HISTORY_STORE.lock:
+        for door, track in HISTORY_STORE.tracks.items():
+            points = track.since(cutoff_ts)
+            if not points: continue
+            doors.append(door)
+            counts.append(len(points))
+            for p_lat, p_lng, p_ts in points:
+                lat.append(p_lat)
+                lng.append(p_lng)
+                ts.append(p_ts)
+    return doors, counts, lat, lng, ts
+
+def save_persisted_snapshot():
+    """Son iyi anlık görüntüyü, pubkey'i ve yakın geçmişi geçici dosyaya yazıp atomik olarak taşır.
+
+    Kaydetmeler SNAPSHOT_SAVE_STATE kilidiyle sıraya girer (arka plan kaydı ve doğrudan çağrılar).
+    """
+    with SNAPSHOT_SAVE_STATE["lock"]:
+        with SNAPSHOT_LOCK:
+            body = GLOBAL_CACHE["encoded"]["identity"]
+            saved_at = GLOBAL_CACHE["last_update"]
+        if not saved_at or GLOBAL_CACHE["source"] != "live": return
+
+        doors, counts, lat, lng, ts = snapshot_history_columns(int(saved_at) - HISTORY_WARM_MINUTES * 60)
+        header = {
+            "saved_at": saved_at,
+            "pubkey": GLOBAL_CACHE["pubkey"],
+            "history": {"doors": doors, "counts": counts},
+        }
+        write_section_file(SNAPSHOT_FILE, SNAPSHOT_MAGIC, header, [body, lat.tobytes(), lng.tobytes(), ts.tobytes()])
+        SNAPSHOT_SAVE_STATE["last_save"] = time.time()
+
+def schedule_snapshot_save():
+    """Başarılı yenilemeden sonra en fazla SNAPSHOT_SAVE_INTERVAL'da bir kaydeder (tek yazıcı)."""
+    state = SNAPSHOT_SAVE_STATE
+    # refresh_snapshot tek uçuşlu olduğu için pending bayrağı yarışsızdır
+    if state["pending"] or time.time() - state["last_save"] < SNAPSHOT_SAVE_INTERVAL: return
+    state["pending"] = True
+
+    def run():
+        try:
+            with METRICS.stage("snapshot_save"):
+                save_persisted_snapshot()
+        except Exception as e:
+            print(f"Snapshot Save Error: {e}")
+        finally:
+            state["pending"] = False
+
+    # Vercel yanıt sonrası thread'leri dondurur; orada istek içinde yazılır
+    if IS_SERVERLESS:
+        run()
+    else:
+        threading.Thread(target=run, name="snapshot-save", daemon=True).start()
+
+def load_persisted_snapshot():
+    """Açılışta kalıcı dosyayı mmap edip hemen sunulacak hale getirir (yaşı last_update'te)."""
+    # Okuyucu süreçler veriyi fetcher'ın nesillerinden alır
+    if PROCESS_ROLE == "reader": return False
+    if GLOBAL_CACHE["data"] or not os.path.exists(SNAPSHOT_FILE): return False
+    try:
+        header, (body, lat, lng, ts) = read_section_file(SNAPSHOT_FILE, SNAPSHOT_MAGIC)
+        body = bytes(body)
+        data = orjson.loads(body)
+        # memoryview.cast ile okunur: açılışta numpy yüklenmez
+        lat, lng, ts = lat.cast("d").tolist(), lng.cast("d").tolist(), ts.cast("q").tolist()
+    except Exception as e:
+        print(f"Snapshot Load Error: {e}")
+        return False
+    if not data: return False
+
+    saved_at = header["saved_at"]
+    if header.get("pubkey") and not GLOBAL_CACHE["pubkey"]:
+        GLOBAL_CACHE["pubkey"] = header["pubkey"]
+
+    # SQLite kopyası duruyorsa geçmiş oradan ısıtılır; yoksa (/tmp silinmiş) dosyadakiler kullanılır
+    if not os.path.exists(HISTORY_DB) and ts:
+        doors = header["history"]["doors"]
+        counts = header["history"]["counts"]
+        door_column = [door for door, count in zip(doors, counts) for _ in range(count)]
+        records = list(zip(door_column, lat, lng, ts))
+        with HISTORY_STORE.lock:
+            HISTORY_STORE.covered_from = min(HISTORY_STORE.covered_from, int(saved_at) - HISTORY_WARM_MINUTES * 60)
+            HISTORY_STORE.warmed = True
+        HISTORY_STORE.add_many(records)
+        save_data_to_db(records)
+
+    publish_snapshot(data, now=saved_at, body=body, source="persisted")
+    print(f"[SNAPSHOT] Loaded {len(data)} vehicles from {SNAPSHOT_FILE} ({time.time() - saved_at:.0f}s old)")
+    return True
+
+# --- ÇOK SÜREÇLİ MOD (tek fetcher, paylaşılan nesiller) ---
+# Fetcher her yeni sürümü değişmez bir nesil dosyasına yazar; okuyucu süreçler dosyayı mmap edip
+# gövdeyi, kapı indeksini ve filo durumu sütunlarını kopyalamadan sunar. Güncel nesil numarası ve
+# son yenileme zamanı küçük bir kontrol dosyasındadır. Kalıcılık gerekmediği için tmpfs
+# (örn. SHARED_SNAPSHOT_DIR=/dev/shm/iett) tercih edilebilir.
+SHARED_SNAPSHOT_DIR = os.getenv('SHARED_SNAPSHOT_DIR') or HISTORY_DB + '.shared'
+SHARED_GENERATION_MAGIC = b"IETTGEN1"
+SHARED_CONTROL_FORMAT = "<Qd"   # nesil numarası, son yenileme zamanı
+SHARED_KEEP_GENERATIONS = 4
+SHARED_POLL_INTERVAL = float(os.getenv('SHARED_POLL_INTERVAL', 0.2))
+# Nesil dosyasındaki bölümler (sıra sabit)
+SHARED_SECTIONS = ("identity", "gzip", "br", "offsets", "present", "codes", "speed", "ts", "displacement", "delay")
+
+# Okuyucu geçmişi bellekte tutmaz; tüm geçmiş sorguları fetcher'ın SQLite'ına düşer
+if PROCESS_ROLE == "reader":
+    HISTORY_STORE.covered_from = sys.maxsize
+
+class SharedIndex:
+    """Nesil dosyasındaki kapı indeksi; kayıt sadece istendiğinde gövdedeki yerinden ayrıştırılır.
+
+    lookup_vehicle'ın kullandığı get() arayüzü GLOBAL_CACHE["index"] sözlüğüyle aynıdır.
+    """
+
+    def __init__(self, keys, doors, body, offsets):
+        self.keys = keys          # normalize kapı kodu -> kayıt sırası
+        self.doors = doors        # kayıt sırası -> vehicle_door
+        self.body = body
+        self.offsets = offsets    # kayıt başına (başlangıç, bitiş), u32
+        self.positions = None
+
+    def record(self, pos):
+        return orjson.loads(self.body[self.offsets[2 * pos]:self.offsets[2 * pos + 1]])
+
+    def get(self, key, default=None):
+        pos = self.keys.get(key)
+        return default if pos is None else self.record(pos)
+
+    def by_door(self, door):
+        """vehicle_door değeriyle (delta günlüğündeki kapılar) kayıt."""
+        if self.positions is None:
+            self.positions = {d: i for i, d in enumerate(self.doors) if d}
+        pos = self.positions.get(door)
+        return None if pos is None else self.record(pos)
+
+class SharedSnapshot:
+    """Fetcher tarafında nesil yayınlar, okuyucu tarafında en yeni nesli benimser.
+
+    Nesil dosyası kalıcı anlık görüntüyle aynı bölümlü düzendedir. Filo listesi okuyucuda sadece
+    filtre / harita / özet uçları istediğinde ve nesil başına bir kez ayrıştırılır. Eski nesiller
+    silinse de onları mmap etmiş okuyucular için dosya geçerli kalır.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.control = None
+        self.seq = 0
+        self.lock = threading.Lock()
+        self.published_version = None   # fetcher
+        self.parsed_seq = 0             # okuyucu: filo listesinin ayrıştırıldığı nesil
+
+    def path(self, seq):
+        return os.path.join(self.directory, f"gen-{seq:012d}.snap")
+
+    def control_path(self):
+        return os.path.join(self.directory, "current")
+
+    # --- fetcher ---
+    def open_writer(self):
+        """Kontrol dosyasını açar; önceki fetcher'ın nesil numarasından devam edilir (okuyucular geri gitmesin)."""
+        os.makedirs(self.directory, exist_ok=True)
+        size = struct.calcsize(SHARED_CONTROL_FORMAT)
+        # Okuyucular aynı inode'u mmap ettiği için dosya yeniden yaratılmaz
+        fd = os.open(self.control_path(), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self.control = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.seq = struct.unpack_from(SHARED_CONTROL_FORMAT, self.control)[0]
+
+    def publish(self):
+        """Sürüm değiştiyse yeni nesil yazar; her durumda son yenileme zamanını günceller."""
+        with self.lock:
+            with SNAPSHOT_LOCK:
+                version = GLOBAL_CACHE["version"]
+                data = GLOBAL_CACHE["data"]
+                index = GLOBAL_CACHE["index"]
+                encoded = GLOBAL_CACHE["encoded"]
+                last_update = GLOBAL_CACHE["last_update"]
+                source = GLOBAL_CACHE["source"]
+                entry = SNAPSHOT_CHANGELOG[-1] if SNAPSHOT_CHANGELOG and SNAPSHOT_CHANGELOG[-1][0] == version else None
+            if version != self.published_version:
+                self.write_generation(version, data, index, encoded, source, entry)
+            struct.pack_into(SHARED_CONTROL_FORMAT, self.control, 0, self.seq, last_update)
+
+    def write_generation(self, version, data, index, encoded, source, entry):
+        # Kayıtlar tek tek serileştirilir: birleşimi orjson.dumps(data) ile aynı, ofsetler bedava
+        parts = [orjson.dumps(v) for v in data]
+        offsets = array("I")
+        position = 1
+        for part in parts:
+            offsets.append(position)
+            position += len(part)
+            offsets.append(position)
+            position += 1
+        body = b"[" + b",".join(parts) + b"]"
+        positions = {id(v): i for i, v in enumerate(data)}
+
+        header = {
+            "epoch": SNAPSHOT_EPOCH,
+            "version": version,
+            "previous_version": self.published_version,
+            "source": source,
+            "count": len(data),
+            "index": {key: positions[id(v)] for key, v in index.items() if id(v) in positions},
+            "doors": [vehicle_door(v) for v in data],
+            "changed": entry[1] if entry else [],
+            "removed": entry[2] if entry else [],
+            "fleet_status": None,
+        }
+        sections = {
+            "identity": body,
+            "gzip": encoded_body(encoded, "gzip"),
+            "br": encoded_body(encoded, "br") if brotli else b"",
+            "offsets": offsets.tobytes(),
+        }
+        state = FLEET_STATUS.state
+        if state is not None and state["version"] == version:
+            slots = [None] * len(state["present"])
+            for door, slot in state["slots"].items():
+                if slot < len(slots): slots[slot] = door
+            header["fleet_status"] = {"generated_at": state["generated_at"], "version": version, "doors": slots}
+            for name in ("present", "codes", "speed", "ts", "displacement", "delay"):
+                sections[name] = state[name].tobytes()
+
+        seq = self.seq + 1
+        write_section_file(self.path(seq), SHARED_GENERATION_MAGIC, header,
+                           [sections.get(name, b"") for name in SHARED_SECTIONS], durable=False)
+        self.seq = seq
+        self.published_version = version
+        for name in os.listdir(self.directory):
+            if name.startswith("gen-") and name.endswith(".snap") and int(name[4:-5]) <= seq - SHARED_KEEP_GENERATIONS:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    # --- okuyucu ---
+    def open_reader(self):
+        try:
+            with open(self.control_path(), "rb") as f:
+                self.control = mmap.mmap(f.fileno(), struct.calcsize(SHARED_CONTROL_FORMAT), access=mmap.ACCESS_READ)
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def poll(self, wait=0):
+        """Kontrol dosyasında yeni nesil varsa benimser; hiç nesil yoksa wait saniyeye kadar bekler."""
+        deadline = time.monotonic() + wait
+        while True:
+            if self.control is not None or self.open_reader():
+                seq, last_update = struct.unpack_from(SHARED_CONTROL_FORMAT, self.control)
+                if seq != self.seq:
+                    with self.lock:
+                        if seq != self.seq: self.adopt(seq)
+                if self.seq:
+                    GLOBAL_CACHE["last_update"] = last_update
+                    return
+            if time.monotonic() >= deadline: return
+            time.sleep(SHARED_POLL_INTERVAL)
+
+    def adopt(self, seq):
+        global SNAPSHOT_EPOCH
+        try:
+            header, views = read_section_file(self.path(seq), SHARED_GENERATION_MAGIC)
+        except FileNotFoundError:
+            # Fetcher bu nesli çoktan silmiş; sonraki yoklamada daha yenisi okunur
+            return
+        sections = dict(zip(SHARED_SECTIONS, views))
+        identity = sections["identity"]
+        encoded = {"etag": f"{header['epoch']}-{header['version']}", "identity": identity, "gzip": sections["gzip"]}
+        if len(sections["br"]): encoded["br"] = sections["br"]
+        index = SharedIndex(header["index"], header["doors"], identity, sections["offsets"].cast("I"))
+
+        with SNAPSHOT_LOCK:
+            # Atlanan nesil (veya yeniden başlayan fetcher) varsa günlük sürekliliği bozulur; tam senkron
+            if header["previous_version"] != GLOBAL_CACHE["version"] or header["epoch"] != SNAPSHOT_EPOCH:
+                SNAPSHOT_CHANGELOG.clear()
+            SNAPSHOT_CHANGELOG.append((header["version"], header["changed"], header["removed"]))
+            SNAPSHOT_EPOCH = header["epoch"]
+            GLOBAL_CACHE["version"] = header["version"]
+            GLOBAL_CACHE["encoded"] = encoded
+            GLOBAL_CACHE["index"] = index
+            GLOBAL_CACHE["size"] = header["count"]
+            GLOBAL_CACHE["source"] = header["source"]
+        FLEET_STATUS.state = self.fleet_status_state(header["fleet_status"], sections)
+        self.seq = seq
+
+        with STREAM_COND:
+            STREAM_COND.notify_all()
+
+    @staticmethod
+    def fleet_status_state(meta, sections):
+        """Filo durumu sütunları mmap üzerinde numpy görünümü olarak; FleetStatus.lookup/report aynen çalışır."""
+        if meta is None: return None
+        return {
+            "generated_at": meta["generated_at"],
+            "version": meta["version"],
+            "slots": {door: slot for slot, door in enumerate(meta["doors"]) if door},
+            "present": np.frombuffer(sections["present"], dtype=bool),
+            "codes": np.frombuffer(sections["codes"], dtype=np.int8),
+            "speed": np.frombuffer(sections["speed"], dtype=np.float64),
+            "ts": np.frombuffer(sections["ts"], dtype=np.float64),
+            "displacement": np.frombuffer(sections["displacement"], dtype=np.float64),
+            "delay": np.frombuffer(sections["delay"], dtype=np.float64),
+            "body": None,
+        }
+
+    def materialize(self):
+        """Filo listesi gereken uçlar için güncel nesli bir kez ayrıştırır (data, attrs, grid, özet)."""
+        if self.parsed_seq == self.seq: return
+        with self.lock:
+            if self.parsed_seq == self.seq: return
+            data = orjson.loads(GLOBAL_CACHE["encoded"]["identity"])
+            attrs = build_vehicle_attrs(data)
+            grid = build_grid_index(data)
+            with SNAPSHOT_LOCK:
+                changed, removed, _ = diff_snapshot(data, int(GLOBAL_CACHE["last_update"]))
+                FLEET_SUMMARY.apply(changed, removed, LAST_KNOWN_RECORDS)
+                GLOBAL_CACHE["data"] = data
+                GLOBAL_CACHE["attrs"] = attrs
+                GLOBAL_CACHE["grid"] = grid
+            self.parsed_seq = self.seq
 
-def get_history_points(door_number: str, minutes: int = 15, max_points: int = 180):
-    """Geçmiş veritabanından belirtilen araç için son N dakikalık konumları getirir."""
-    if not os.path.exists(HISTORY_DB):
-        return []
+SHARED_SNAPSHOT = SharedSnapshot(SHARED_SNAPSHOT_DIR)
 
-    minutes = max(1, min(minutes, 240))
-    cutoff_ts = int((datetime.now().timestamp()) - minutes * 60)
+def ensure_snapshot_parsed():
+    """Okuyucu süreçte filo listesini kullanan uçlardan önce çağrılır; diğer rollerde etkisiz."""
+    if PROCESS_ROLE == "reader":
+        SHARED_SNAPSHOT.materialize()
 
+def shared_follower():
+    """Okuyucu süreçte yeni nesilleri yoklar; SSE akışları bu sayede bekletilmeden uyanır."""
+    print(f"Shared snapshot follower started ({SHARED_SNAPSHOT_DIR})...")
+    while True:
+        try:
+            SHARED_SNAPSHOT.poll()
+        except Exception as e:
+            print(f"Shared Snapshot Error: {e}")
+        time.sleep(SHARED_POLL_INTERVAL)
+
+# --- YENİLEME KOORDİNATÖRÜ ---
+def refresh_snapshot(wait=False):
+    """Tek uçuşlu yenileme: aynı anda en fazla bir IETT isteği yapılır.
+
+    Başka bir yenileme sürüyorsa wait=True ile onun sonucu beklenir, aksi halde None döner.
+    """
+    with REFRESH_COND:
+        if REFRESH_STATE["in_flight"]:
+            if not wait: return None
+            REFRESH_COND.wait(timeout=REFRESH_WAIT_TIMEOUT)
+            return REFRESH_STATE["last_ok"]
+        # Devre açıkken IETT'ye gidilmez, eldeki son veri sunulmaya devam eder
+        if not POLL_SCHEDULER.allow_attempt():
+            METRICS.inc("iett_refresh_total", result="breaker_open")
+            return False
+        REFRESH_STATE["in_flight"] = True
+
+    ok = False
+    result = "error"
+    new_data, changed = [], 0
     try:
-        with sqlite3.connect(HISTORY_DB) as conn:
-            cur = conn.cursor()
-            cur.execute(
-                """
-                SELECT latitude, longitude, timestamp
-                FROM history
-                WHERE door_number = ? AND timestamp >= ?
-                ORDER BY timestamp ASC
-                """,
-                (door_number, cutoff_ts),
-            )
-            rows = cur.fetchall()
-
+        with METRICS.stage("total"):
+            new_data = fetch_from_iett()
+            if new_data:
+                HISTORY_STORE.warm_from_db()
+                version = GLOBAL_CACHE["version"]
+                with METRICS.stage("publish"):
+                    if publish_snapshot(new_data) != version:
+                        _, changed_records, removed = SNAPSHOT_CHANGELOG[-1]
+                        changed = len(changed_records) + len(removed)
+                ok = True
+        if ok:
+            schedule_snapshot_save()
+            if PROCESS_ROLE == "fetcher":
+                with METRICS.stage("shared_publish"):
+                    SHARED_SNAPSHOT.publish()
+        result = "ok" if ok else "empty"
+    finally:
+        METRICS.inc("iett_refresh_total", result=result)
+        POLL_SCHEDULER.record(ok, changed, len(new_data))
+        with REFRESH_COND:
+            REFRESH_STATE["in_flight"] = False
+            REFRESH_STATE["last_attempt"] = time.time()
+            REFRESH_STATE["last_ok"] = ok
+            REFRESH_COND.notify_all()
+    return ok
+
+def refresh_async():
+    """Yenileme sürmüyorsa arka planda başlatır (stale-while-revalidate)."""
+    if not REFRESH_STATE["in_flight"]:
+        threading.Thread(target=refresh_snapshot, daemon=True).start()
+
+def start_background_workers():
+    """Uzun ömürlü süreçte (waitress) fetcher ve temizlik thread'lerini bir kez başlatır.
+
+    Okuyucu süreçte bunların yerine sadece nesil takipçisi çalışır.
+    """
+    with REFRESH_COND:
+        if REFRESH_STATE["workers_started"]: return
+        REFRESH_STATE["workers_started"] = True
+
+    if PROCESS_ROLE == "reader":
+        threading.Thread(target=shared_follower, name="shared-follower", daemon=True).start()
+        return
+    threading.Thread(target=background_worker, daemon=True).start()
+    threading.Thread(target=cleanup_worker, daemon=True).start()
+
+@app.before_request
+def ensure_background_workers():
+    if not IS_SERVERLESS and not REFRESH_STATE["workers_started"]:
+        start_background_workers()
+
+
+HISTORY_MAX_POINTS_LIMIT = 5000
+HISTORY_FORMATS = ('points', 'arrays', 'polyline')
+
+def history_time_strs(timestamps):
+    """Epoch dizisini TR saatine (sabit UTC+3) çevirir; gün içi saniye başına bir kez biçimlenir."""
+    local = (np.asarray(timestamps, dtype=np.int64) + TR_UTC_OFFSET) % 86400
+    return [tr_clock_str(seconds) for seconds in local.tolist()]
+
+def douglas_peucker(x, y, tolerance):
+    """Çizgiden tolerance (metre) kadar sapmayan ara noktaları atar; tutulan indeks maskesi döner."""
+    keep = np.zeros(len(x), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(x) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2: continue
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        px, py = x[start + 1:end] - x[start], y[start + 1:end] - y[start]
+        length = np.hypot(dx, dy)
+        if length == 0:
+            distances = np.hypot(px, py)
+        else:
+            distances = np.abs(dx * py - dy * px) / length
+        i = int(np.argmax(distances))
+        if distances[i] > tolerance:
+            split = start + 1 + i
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return keep
+
+def decimate_by_time(ts, max_points):
+    """Zaman aralığını max_points dilime böler, her dilimin son noktasını tutar (uçlar her zaman kalır)."""
+    span = ts[-1] - ts[0]
+    if span <= 0:
+        return np.unique(np.linspace(0, len(ts) - 1, max_points).astype(np.int64))
+    # max_points - 1 dilim + ilk nokta
+    bins = ((ts - ts[0]) * (max_points - 1) // (span + 1)).astype(np.int64)
+    last_in_bin = np.flatnonzero(np.append(bins[1:] != bins[:-1], True))
+    return np.unique(np.concatenate(([0], last_in_bin)))
+
+def simplify_track(lat, lng, ts, max_points, tolerance=0):
+    """Önce (varsa) Douglas-Peucker, nokta sayısı hâlâ fazlaysa zaman dilimi seyreltmesi."""
+    if len(ts) <= 2: return lat, lng, ts
+    if tolerance > 0:
+        # Kısa mesafede eşdikdörtgen izdüşüm yeterli
+        y = np.radians(lat) * 6371000
+        x = np.radians(lng) * 6371000 * np.cos(np.radians(lat.mean()))
+        keep = douglas_peucker(x, y, tolerance)
+        lat, lng, ts = lat[keep], lng[keep], ts[keep]
+    if max_points and len(ts) > max_points:
+        keep = decimate_by_time(ts, max_points)
+        lat, lng, ts = lat[keep], lng[keep], ts[keep]
+    return lat, lng, ts
+
+def encode_polyline(lat, lng):
+    """Google encoded polyline (5 basamak)."""
+    coords = np.round(np.column_stack((lat, lng)) * 1e5).astype(np.int64)
+    deltas = np.diff(coords, axis=0, prepend=[[0, 0]]).ravel().tolist()
+    out = []
+    for value in deltas:
+        value = ~(value << 1) if value < 0 else value << 1
+        while value >= 0x20:
+            out.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        out.append(chr(value + 63))
+    return ''.join(out)
+
+def history_track(door_number: str, minutes: int = 15, max_points: int = 180, tolerance: float = 0):
+    """Belirtilen araç için son N dakikalık konumları (lat, lng, ts) dizileri olarak döndürür, sadeleştirilmiş."""
+    minutes = max(1, min(minutes, HISTORY_RETENTION_MINUTES))
+    cutoff_ts = int((datetime.now().timestamp()) - minutes * 60)
 
+    rows = HISTORY_STORE.query(door_number, cutoff_ts)
+    if rows is None:
+        rows = query_history_db(door_number, cutoff_ts)
+
+    if not rows:
+        return np.empty(0), np.empty(0), np.empty(0, dtype=np.int64)
+    lat, lng, ts = (np.asarray(column) for column in zip(*rows))
+    return simplify_track(lat.astype(float), lng.astype(float), ts.astype(np.int64), max_points, tolerance)
+
+def format_history(lat, lng, ts, fmt='points'):
+    """points: [{lat, lng, timestamp, time}], arrays: paralel listeler, polyline: kodlanmış çizgi + zamanlar."""
+    if fmt == 'polyline':
+        return {"polyline": encode_polyline(lat, lng), "timestamp": ts.tolist()}
+    times = history_time_strs(ts)
+    if fmt == 'arrays':
+        return {"lat": lat.tolist(), "lng": lng.tolist(), "timestamp": ts.tolist(), "time": times}
+    return [
+        {"lat": la, "lng": ln, "timestamp": t, "time": tm}
+        for la, ln, t, tm in zip(lat.tolist(), lng.tolist(), ts.tolist(), times)
+    ]
 
+def get_history_points(door_number: str, minutes: int = 15, max_points: int = 180):
+    """Belirtilen araç için son N dakikalık konumları getirir (önce bellekten, yoksa veritabanından)."""
+    return format_history(*history_track(door_number, minutes, max_points))
 
-    except Exception as e:
-        print(f"History query error: {e}")
+def query_history_db(door_number, cutoff_ts):
+    """Bellek kapsamadığında SQLite'tan okur."""
+    if not os.path.exists(HISTORY_DB):
         return []
 
-    history = []
-    # ŞİMDİ (Türkiye Saati)
-    tz = pytz.timezone('Europe/Istanbul')
-    now = datetime.now(tz)
-    current_date_str = now.strftime("%d-%m-%Y")
-    current_time_str = now.strftime("%H:%M:%S")
-    for lat, lng, ts in rows:
-        try:
-            # UTC Timestamp -> Turkey Time
-            dt = datetime.fromtimestamp(ts, pytz.timezone('Europe/Istanbul'))
-            time_str = dt.strftime("%H:%M:%S")
-        except Exception:
-            time_str = "--:--:--"
-
-        history.append(
-            {
-                "lat": float(lat),
-                "lng": float(lng),
-                "timestamp": int(ts),
-                "time": time_str,
-            }
+    def run(conn):
+        # Sadece istenen aralıkla kesişen dilimler taranır
+        buckets = history_buckets_since(conn, cutoff_ts)
+        if not buckets: return []
+        sql = " UNION ALL ".join(
+            f"SELECT latitude, longitude, timestamp FROM {history_table(bucket)} WHERE door_number = ? AND timestamp >= ?"
+            for bucket in buckets
         )
+        return conn.execute(sql + " ORDER BY timestamp ASC", (door_number, cutoff_ts) * len(buckets)).fetchall()
 
-    return history
+    try:
+        with history_read_conn() as conn:
+            return read_history_buckets(conn, run)
+    except Exception as e:
+        print(f"History query error: {e}")
+        return []
 
 def fetch_vehicle_tasks(door_code):
     """Belirtilen kapı numarası için görevleri çeker."""
     try:
-        with requests.Session() as session:
-            pub_key = get_pubkey(session)
-            if not pub_key: return []
-
-            # Şifreleme
-            aes_key = get_random_bytes(32)
-            rsa_key = RSA.import_key(pub_key)
-            cipher = PKCS1_OAEP.new(rsa_key, hashAlgo=SHA256)
-            enc_key_b64 = base64.b64encode(cipher.encrypt(aes_key)).decode("ascii")
-
-            # İstek
-            url = TASK_URL_TMPL.format(door_code=door_code)
-            payload = {"encKey": enc_key_b64}
-            resp = session.post(url, headers=HEADERS, json=payload, timeout=8, verify=False)
-            
-            if resp.status_code != 200: return []
-
-            data_json = resp.json()
-            if not data_json or "data" not in data_json: return []
-
-            # Çözme
-            iv = base64.b64decode(data_json.get("iv"))
-            full_data = base64.b64decode(data_json.get("data"))
-            
-            tag = full_data[-16:]      
-            ciphertext = full_data[:-16] 
-            
-            cipher_aes = AES.new(aes_key, AES.MODE_GCM, nonce=iv)
-            plaintext = cipher_aes.decrypt_and_verify(ciphertext, tag)
-            
-            final_data = orjson.loads(plaintext)
-            if isinstance(final_data, list):
-                return final_data
-            
-            return []
+        url = TASK_URL_TMPL.format(door_code=door_code)
+        final_data = UPSTREAM.post_encrypted(url)
+        if isinstance(final_data, list):
+            return final_data
+        
+        return []
 
     except Exception as e:
         print(f"Task Fetch Error: {e}")
@@ -428,6 +2378,86 @@ def simplify_tasks(tasks):
     
     return simplified
 
+# --- GÖREV ÖNBELLEĞİ ---
+class TaskCache:
+    """Kapı kodu -> sadeleştirilmiş görev listesi önbelleği (thread-safe).
+
+    TTL ve LRU ile sınırlıdır; boş sonuçlar daha kısa süre tutulur. Aynı kapı için eşzamanlı
+    istekler tek bir IETT çağrısında birleşir.
+    """
+
+    def __init__(self, loader, ttl, negative_ttl, max_entries):
+        self.loader = loader
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # kapı -> (son geçerlilik, görevler)
+        self.inflight = {}            # kapı -> threading.Event
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get(self, door_code):
+        key = door_code.strip().upper()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > time.time():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            event = self.inflight.get(key)
+            leader = event is None
+            if leader:
+                event = self.inflight[key] = threading.Event()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            # Aynı kapı için süren çağrının sonucunu bekle
+            event.wait(timeout=REFRESH_WAIT_TIMEOUT)
+            with self.lock:
+                entry = self.entries.get(key)
+            return entry[1] if entry else []
+
+        value = []
+        try:
+            value = self.loader(door_code)
+        finally:
+            ttl = self.ttl if value else self.negative_ttl
+            with self.lock:
+                self.entries[key] = (time.time() + ttl, value)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+                    self.evictions += 1
+                del self.inflight[key]
+            event.set()
+        return value
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "hit_rate": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+                "ttl": self.ttl,
+                "negative_ttl": self.negative_ttl
+            }
+
+TASK_CACHE = TaskCache(
+    lambda door_code: simplify_tasks(fetch_vehicle_tasks(door_code)),
+    ttl=TASK_CACHE_DURATION,
+    negative_ttl=TASK_NEGATIVE_CACHE_DURATION,
+    max_entries=TASK_CACHE_MAX_ENTRIES,
+)
 
 
 # --- AUTHENTICATION DISABLED ---
@@ -483,175 +2513,429 @@ def calculate_haversine_distance(lat1, lon1, lat2, lon2):
 
     return R * c
 
-def get_history_points_internal(door_number: str, minutes: int = 5):
-    """Internal helper to get history points without Flask context if needed."""
-    if not os.path.exists(HISTORY_DB):
-        return []
+# SQLite parametre sınırının (eski sürümlerde 999) altında kalmak için
+HISTORY_BULK_CHUNK = 500
+
+def get_history_points_bulk(door_numbers, minutes: int = 5):
+    """Birden çok araç için son N dakikalık noktaları tek bağlantı ve tek indeksli sorguyla getirir.
 
+    Dönüş: {kapı: [{"lat", "lng", "timestamp"}, ...]} (eskiden yeniye).
+    """
+    doors = list(dict.fromkeys(d for d in door_numbers if d))
+    result = {door: [] for door in doors}
     cutoff_ts = int((datetime.now().timestamp()) - minutes * 60)
-    try:
-        with sqlite3.connect(HISTORY_DB) as conn:
-            cur = conn.cursor()
-            cur.execute(
-                "SELECT latitude, longitude, timestamp FROM history WHERE door_number = ? AND timestamp >= ? ORDER BY timestamp ASC",
-                (door_number, cutoff_ts),
+
+    # Bellekte eksiksiz olanlar oradan, kalanlar SQLite'tan
+    missing = []
+    for door in doors:
+        rows = HISTORY_STORE.query(door, cutoff_ts)
+        if rows is None:
+            missing.append(door)
+        else:
+            result[door] = [{"lat": lat, "lng": lng, "timestamp": ts} for lat, lng, ts in rows]
+
+    doors = missing
+    if not doors or not os.path.exists(HISTORY_DB):
+        return result
+
+    def run(conn):
+        rows = {door: [] for door in doors}
+        buckets = history_buckets_since(conn, cutoff_ts)
+        if not buckets: return rows
+        for i in range(0, len(doors), HISTORY_BULK_CHUNK):
+            chunk = doors[i:i + HISTORY_BULK_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            # Birincil anahtar (door_number, timestamp): her kapı için ayrı aralık taraması, sonuçlar sıralı gelir
+            sql = " UNION ALL ".join(
+                f"SELECT door_number, latitude, longitude, timestamp FROM {history_table(bucket)} "
+                f"WHERE door_number IN ({placeholders}) AND timestamp >= ?"
+                for bucket in buckets
             )
-            rows = cur.fetchall()
+            for door, lat, lng, ts in conn.execute(sql + " ORDER BY door_number, timestamp ASC", (*chunk, cutoff_ts) * len(buckets)):
+                rows[door].append({
+                    "lat": float(lat),
+                    "lng": float(lng),
+                    "timestamp": int(ts)
+                })
+        return rows
+
+    try:
+        with history_read_conn() as conn:
+            result.update(read_history_buckets(conn, run))
     except Exception as e:
         print(f"History Query Error: {e}")
-        return []
 
-    history = []
-    for lat, lng, ts in rows:
-        history.append({
-            "lat": float(lat),
-            "lng": float(lng),
-            "timestamp": int(ts)
+    return result
+
+# --- FİLO DURUMU (Sütunsal) ---
+MOVEMENT_WINDOW = 300          # Yer değiştirme bu kadar saniye öncesine göre ölçülür
+MOVEMENT_BASELINE_STEP = 15    # Konum sütunlarının kopyası en fazla bu sıklıkta saklanır
+SIGNAL_LOST_MINUTES = 10
+MOVING_SPEED = 3
+MOVING_DISPLACEMENT = 50
+
+# Durum kodları; sıra FleetStatus.classify'daki np.select ile aynı
+STATUS_LABELS = (
+    "PC KAPALI",             # tarih/saat yok
+    "VERİ HATASI",           # tarih veya hız okunamadı
+    "SİNYAL KESİK",
+    "HAREKETLİ",
+    "DURUYOR",               # hız var ama yer değiştirmemiş (GPS sapması)
+    "HAREKETLİ (Dur-Kalk)",
+    "DURUYOR",
+)
+NO_DATA_STATUS = "PC KAPALI / VERİ YOK"
+
+def haversine_np(lat1, lng1, lat2, lng2):
+    """calculate_haversine_distance'ın dizi hali (metre)."""
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    a = np.sin((phi2 - phi1) / 2.0) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(np.radians(lng2 - lng1) / 2.0) ** 2
+    return 2 * 6371000 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+class FleetStatus:
+    """Her yenilemede filonun sütunsal kopyasını (lat, lng, hız, zaman) kurar ve tüm araçların
+    hareket durumunu tek vektörel geçişte hesaplar; batch analizi bir sözlük aramasına iner.
+
+    Kapılar kalıcı satır numarası (slot) alır, böylece eski konum kopyaları yeni sütunlarla
+    hizalı kalır. Yer değiştirme, pencere içindeki en eski kopyaya göre ölçülür.
+    """
+
+    def __init__(self):
+        self.slots = {}
+        self.baselines = deque()  # (zaman, lat, lng)
+        self.state = None
+        self.lock = threading.Lock()
+
+    def columns(self, data):
+        size = len(self.slots) + len(data)
+        lat = np.full(size, np.nan)
+        lng = np.full(size, np.nan)
+        speed = np.full(size, np.nan)
+        ts = np.full(size, np.nan)
+        has_time = np.zeros(size, dtype=bool)
+        present = np.zeros(size, dtype=bool)
+
+        slots = self.slots
+        for v in data:
+            door = vehicle_door(v)
+            if not door: continue
+            slot = slots.get(door)
+            if slot is None:
+                slot = slots[door] = len(slots)
+            present[slot] = True
+            has_time[slot] = bool(v.get('lastLocationDate') and v.get('lastLocationTime'))
+            loc_ts = v.get('lastLocationTs')
+            if loc_ts is not None: ts[slot] = loc_ts
+            try:
+                lat[slot] = float(v.get('latitude'))
+                lng[slot] = float(v.get('longitude'))
+            except (TypeError, ValueError):
+                pass
+            try:
+                speed[slot] = float(v.get('speed', 0))
+            except (TypeError, ValueError):
+                pass
+
+        size = len(slots)
+        return lat[:size], lng[:size], speed[:size], ts[:size], has_time[:size], present[:size]
+
+    def seed_baseline(self, lat, lng, now):
+        """İlk yenilemede pencere başı konumlarını bellekteki geçmişten alır."""
+        base_lat = lat.copy()
+        base_lng = lng.copy()
+        cutoff_ts = int(now) - MOVEMENT_WINDOW
+        for door, slot in self.slots.items():
+            rows = HISTORY_STORE.query(door, cutoff_ts)
+            if rows:
+                base_lat[slot], base_lng[slot] = rows[0][0], rows[0][1]
+        self.baselines.append((now, base_lat, base_lng))
+
+    def baseline(self, lat, lng, now):
+        baselines = self.baselines
+        if not baselines:
+            self.seed_baseline(lat, lng, now)
+        elif now - baselines[-1][0] >= MOVEMENT_BASELINE_STEP:
+            baselines.append((now, lat, lng))
+        while len(baselines) > 1 and baselines[1][0] <= now - MOVEMENT_WINDOW:
+            baselines.popleft()
+
+        _, base_lat, base_lng = baselines[0]
+        if len(base_lat) < len(lat):
+            # Sonradan gelen araçlar için başlangıç noktası şimdiki konumları
+            base_lat = np.concatenate((base_lat, lat[len(base_lat):]))
+            base_lng = np.concatenate((base_lng, lng[len(base_lng):]))
+        return base_lat, base_lng
+
+    def classify(self, lat, lng, speed, ts, has_time, base_lat, base_lng, now):
+        displacement = np.nan_to_num(haversine_np(base_lat, base_lng, lat, lng))
+        delay = np.maximum((now - ts) / 60.0, 0)
+        moved = displacement > MOVING_DISPLACEMENT
+        fast = speed > MOVING_SPEED
+        codes = np.select(
+            [~has_time, np.isnan(ts) | np.isnan(speed), delay > SIGNAL_LOST_MINUTES, fast & moved, fast, moved],
+            [0, 1, 2, 3, 4, 5],
+            default=6,
+        ).astype(np.int8)
+        return codes, displacement, delay
+
+    def update(self, data, now):
+        with self.lock:
+            lat, lng, speed, ts, has_time, present = self.columns(data)
+            base_lat, base_lng = self.baseline(lat, lng, now)
+            codes, displacement, delay = self.classify(lat, lng, speed, ts, has_time, base_lat, base_lng, now)
+            # Okuyucular tek bir referans değişimiyle yeni duruma geçer
+            self.state = {
+                "generated_at": now,
+                "version": GLOBAL_CACHE["version"],
+                "slots": self.slots.copy(),
+                "present": present,
+                "codes": codes,
+                "speed": speed,
+                "ts": ts,
+                "displacement": displacement,
+                "delay": delay,
+                "body": None,
+            }
+
+    @staticmethod
+    def detail(state, slot):
+        code = state["codes"][slot]
+        if code == 0: return "Tarih/Saat Yok"
+        if code == 1: return "Tarih Okunamadı" if np.isnan(state["ts"][slot]) else "Hız Okunamadı"
+        if code == 2: return f"{int(state['delay'][slot])} dk gecikme"
+        if code == 3: return f"{float(state['speed'][slot])} km/h"
+        if code == 4: return f"{float(state['speed'][slot])} km/h (GPS Sapması)"
+        return f"{int(state['displacement'][slot])}m Yer Değ."
+
+    def lookup(self, door):
+        """(durum, detay); araç son yenilemede yoksa None."""
+        state = self.state
+        if state is None: return None
+        slot = state["slots"].get(door)
+        if slot is None or slot >= len(state["present"]) or not state["present"][slot]: return None
+        return STATUS_LABELS[state["codes"][slot]], self.detail(state, slot)
+
+    def rows(self, state):
+        doors = [None] * len(state["present"])
+        for door, slot in state["slots"].items():
+            if slot < len(doors): doors[slot] = door
+        return [
+            {
+                "door": doors[slot],
+                "vehicle_status": STATUS_LABELS[state["codes"][slot]],
+                "detail": self.detail(state, slot),
+                "speed": None if np.isnan(state["speed"][slot]) else float(state["speed"][slot]),
+                "displacement": int(state["displacement"][slot]),
+            }
+            for slot in np.flatnonzero(state["present"]).tolist()
+        ]
+
+    def report(self, statuses=None, doors=None):
+        """/api/fleet-status gövdesi; filtresiz hali yenileme başına bir kez serileştirilir."""
+        state = self.state
+        if state is None: return None
+        if not statuses and not doors and state["body"] is not None:
+            return state["body"]
+
+        rows = self.rows(state)
+        counts = {}
+        for row in rows:
+            counts[row["vehicle_status"]] = counts.get(row["vehicle_status"], 0) + 1
+        if statuses:
+            rows = [row for row in rows if row["vehicle_status"] in statuses]
+        if doors:
+            rows = [row for row in rows if row["door"] in doors]
+
+        body = orjson.dumps({
+            "generatedAt": int(state["generated_at"]),
+            "version": state["version"],
+            "counts": counts,
+            "vehicles": rows,
         })
-    return history
+        if not statuses and not doors:
+            state["body"] = body
+        return body
+
+FLEET_STATUS = FleetStatus()
+
+def analyze_door(door):
+    """Tek bir araç için görev ve hareket durumunu çıkarır (batch-analyze satırı).
+
+    Hareket durumu her yenilemede tüm filo için hesaplanır (FLEET_STATUS); burada sadece okunur.
+    """
+    # Decoupled Statuses
+    task_status = "UNKNOWN" # VAR / YOK
+    vehicle_status = "UNKNOWN" # HAREKETLİ / DURUYOR / SİNYAL KESİK / PC KAPALI / VERİ YOK
+    detail = ""
+
+    # 1. TASK CHECK (Independent)
+    simple_tasks = TASK_CACHE.get(door)
+    if len(simple_tasks) > 0:
+         task_status = "VAR"
+    else:
+         task_status = "YOK"
+
+    # 2. DATA & MOVEMENT CHECK (Independent of Task)
+    vehicle = lookup_vehicle(door)
+    status = FLEET_STATUS.lookup(vehicle_door(vehicle)) if vehicle else None
+
+    if not status:
+        vehicle_status = NO_DATA_STATUS
+    else:
+        vehicle_status, detail = status
+
+    return {
+        "door": door,
+        "task_status": task_status,
+        "vehicle_status": vehicle_status,
+        "detail": detail
+    }
+
+def batch_timeout_row(door, detail):
+    return {
+        "door": door,
+        "task_status": "UNKNOWN",
+        "vehicle_status": "ZAMAN AŞIMI",
+        "detail": detail
+    }
+
+def iter_batch_results(doors):
+    """Kapıları sınırlı havuzda paralel analiz eder, biten satırı hemen üretir.
+
+    Dönüş: (girdi sırası, satır). Kapı başına ve toplam süre sınırını aşanlar zaman aşımı satırı alır.
+    """
+    deadline = time.monotonic() + BATCH_TOTAL_TIMEOUT
+    started = {}
+
+    def run(i, door):
+        started[i] = time.monotonic()
+        return analyze_door(door)
+
+    futures = {BATCH_EXECUTOR.submit(run, i, door): (i, door) for i, door in enumerate(doors)}
+    pending = set(futures)
+    try:
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0: break
+
+            done, pending = wait(pending, timeout=min(remaining, 0.5), return_when=FIRST_COMPLETED)
+            for future in done:
+                i, door = futures[future]
+                try:
+                    yield i, future.result()
+                except Exception as e:
+                    print(f"Analysis Error {door}: {e}")
+                    yield i, {"door": door, "task_status": "UNKNOWN", "vehicle_status": "VERİ HATASI", "detail": str(e)[:20]}
+
+            # Tek bir yavaş kapı tüm listeyi bekletmesin
+            now = time.monotonic()
+            for future in [f for f in pending if now - started.get(futures[f][0], now) > BATCH_DOOR_TIMEOUT]:
+                pending.discard(future)
+                i, door = futures[future]
+                yield i, batch_timeout_row(door, f"{BATCH_DOOR_TIMEOUT} sn")
+
+        for future in pending:
+            future.cancel()
+            i, door = futures[future]
+            yield i, batch_timeout_row(door, "Toplam süre doldu")
+    finally:
+        # İstemci koptuysa generator bir yield'de kapatılır; sıradaki kapılar IETT'ye gitmesin
+        for future in futures:
+            future.cancel()
 
 @app.route('/api/batch-analyze', methods=['POST'])
 @login_required
 def batch_analyze():
+    """Kapı listesini analiz eder.
+
+    Accept: application/x-ndjson (veya ?stream=1) ile her kapı bittikçe bir satır akıtılır,
+    aksi halde girdi sırasıyla tek bir JSON listesi döner.
+    """
     try:
         door_numbers = request.json.get('doors', [])
-        results = []
-        
-        # Optimize: Get all current data map
-        current_data_map = {v.get('vehicleDoorCode'): v for v in GLOBAL_CACHE.get("data", []) if v.get('vehicleDoorCode')}
-        # Backup map by busDoorNumber
-        current_data_map_bus = {v.get('busDoorNumber'): v for v in GLOBAL_CACHE.get("data", []) if v.get('busDoorNumber')}
-        
-        for door in door_numbers:
-            door = door.strip().upper()
-            if not door: continue
-            
-            # Decoupled Statuses
-            task_status = "UNKNOWN" # VAR / YOK
-            vehicle_status = "UNKNOWN" # HAREKETLİ / DURUYOR / SİNYAL KESİK / PC KAPALI / VERİ YOK
-            detail = ""
-            
-            # 1. TASK CHECK (Independent)
-            tasks = fetch_vehicle_tasks(door)
-            simple_tasks = simplify_tasks(tasks)
-            if len(simple_tasks) > 0:
-                 task_status = "VAR"
-            else:
-                 task_status = "YOK"
-            
-            # 2. DATA & MOVEMENT CHECK (Independent of Task)
-            vehicle = current_data_map.get(door) or current_data_map_bus.get(door)
-            
-            if not vehicle:
-                vehicle_status = "PC KAPALI / VERİ YOK"
-            else:
-                try:
-                    # Check Data Freshness
-                    v_date = str(vehicle.get('lastLocationDate', '')).strip()
-                    v_time = str(vehicle.get('lastLocationTime', '')).strip()
-                    
-                    if not v_date or not v_time:
-                         vehicle_status = "PC KAPALI"
-                         detail = "Tarih/Saat Yok"
-                    else:
-                        # Try multiple formats
-                        v_dt = None
-                        formats = [
-                            "%d-%m-%Y %H:%M:%S",
-                            "%d.%m.%Y %H:%M:%S",
-                            "%Y-%m-%d %H:%M:%S",
-                            "%d-%m-%Y %H:%M",
-                            "%Y-%m-%dT%H:%M:%S"
-                        ]
-                        
-                        v_dt_str = f"{v_date} {v_time}"
-                        for fmt in formats:
-                            try:
-                                v_dt = datetime.strptime(v_dt_str, fmt)
-                                break
-                            except ValueError:
-                                continue
-                        
-                        if not v_dt:
-                             vehicle_status = "VERİ HATASI" 
-                             detail = "Tarih Okunamadı"
-                        else:
-                            now = datetime.now()
-                            diff_minutes = (now - v_dt).total_seconds() / 60.0
-                            if diff_minutes < -1: diff_minutes = 0
-                            
-                            if diff_minutes > 10:
-                                vehicle_status = "SİNYAL KESİK"
-                                detail = f"{int(diff_minutes)} dk gecikme"
-                            else:
-                                # 3. MOVEMENT CHECK (Ghost Speed Logic)
-                                speed = float(vehicle.get('speed', 0))
-                                
-                                history = get_history_points_internal(door, minutes=5)
-                                displacement = 0
-                                if history:
-                                    oldest = history[0]
-                                    newest = history[-1]
-                                    displacement = calculate_haversine_distance(oldest['lat'], oldest['lng'], newest['lat'], newest['lng'])
-
-                                if speed > 3:
-                                    if displacement > 50:
-                                        vehicle_status = "HAREKETLİ"
-                                        detail = f"{speed} km/h"
-                                    else:
-                                        vehicle_status = "DURUYOR"
-                                        detail = f"{speed} km/h (GPS Sapması)"
-                                else:
-                                    if displacement > 50:
-                                        vehicle_status = "HAREKETLİ (Dur-Kalk)"
-                                        detail = f"{int(displacement)}m Yer Değ."
-                                    else:
-                                        vehicle_status = "DURUYOR"
-                                        detail = f"{int(displacement)}m Yer Değ."
-                except Exception as e:
-                    print(f"Analysis Error {door}: {e}")
-                    vehicle_status = "VERİ HATASI"
-                    detail = str(e)[:20]
-
-            results.append({
-                "door": door,
-                "task_status": task_status,
-                "vehicle_status": vehicle_status,
-                "detail": detail
-            })
-            
+        doors = [door.strip().upper() for door in door_numbers if door and door.strip()]
+
+        wants_stream = request.args.get('stream') == '1' or 'application/x-ndjson' in request.headers.get('Accept', '')
+        if wants_stream:
+            def generate():
+                for _, row in iter_batch_results(doors):
+                    yield orjson.dumps(row) + b"\n"
+
+            response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+            response.headers['X-Accel-Buffering'] = 'no'
+            return response
+
+        results = [None] * len(doors)
+        for i, row in iter_batch_results(doors):
+            results[i] = row
         return jsonify(results)
     except Exception as e:
          return jsonify({"error": str(e)}), 500
 
+def refresh_if_stale():
+    """İstek yolunda tazelik kontrolü: son iyi veri sunulur, yenileme tek uçuşta yapılır."""
+    POLL_SCHEDULER.note_demand()
+    if PROCESS_ROLE == "reader":
+        # Okuyucu IETT'ye gitmez; fetcher'ın yayınladığı son nesil benimsenir
+        SHARED_SNAPSHOT.poll(wait=REFRESH_WAIT_TIMEOUT)
+        return
+
+    age = time.time() - GLOBAL_CACHE["last_update"]
+    if GLOBAL_CACHE["data"] and age < CACHE_DURATION:
+        return
+
+    if not GLOBAL_CACHE["data"]:
+        # Hiç veri yoksa (soğuk başlangıç) sürmekte olan yenilemeyi bekle veya başlat
+        refresh_snapshot(wait=True)
+    elif REFRESH_STATE["workers_started"]:
+        # Background worker veriyi tazeliyor, eskiyi sunmaya devam et
+        return
+    elif GLOBAL_CACHE["source"] != "live":
+        # Açılışta dosyadan yüklenen veri hemen sunulur, ilk canlı yenileme arka planda
+        refresh_async()
+    elif age > STALE_MAX_AGE:
+        # Vercel: veri çok eskiyse bu istek yenilemeyi bekler
+        refresh_snapshot(wait=True)
+    else:
+        refresh_async()
+
 @app.route('/api/veriler')
 def veriler():
+    """Filo listesi.
+
+    ?since=<sürüm> ile delta döner (filtreler uygulanmaz). ?operator=, ?state=active|inactive,
+    ?stale=<saniye>, ?q=, ?fields=a,b, ?offset=, ?limit= ile sunucu tarafında filtrelenir;
+    toplam eşleşme X-Total-Count başlığındadır.
+    """
     try:
-        current_time = time.time()
-        
-        if GLOBAL_CACHE["data"] and (current_time - GLOBAL_CACHE["last_update"] < CACHE_DURATION):
-            data = GLOBAL_CACHE["data"]
-        else:
-            # Veri eskimişse veya yoksa çek
-            new_data = fetch_from_iett()
-            if new_data:
-                GLOBAL_CACHE["data"] = new_data
-                GLOBAL_CACHE["last_update"] = current_time
-                data = new_data
-                # Vercel'de background worker olmadığı için her istekte DB'ye yazmayı deneyebiliriz
-                # Ancak bu performansı etkileyebilir. "History" özelliği kritik değilse atlanabilir.
-                # Şimdilik "save_data_to_db" yi çağırıyoruz ki anlık history oluşsun.
-                # Her istekte DB init kontrolü yapılması gerekebilir çünkü /tmp silinebilir.
-                init_db()
-                save_data_to_db(data)
-            else:
-                data = GLOBAL_CACHE["data"]
+        refresh_if_stale()
 
-        # 2. Vercel CDN Cache Ayarı (TAMAMEN KAPALI - ANLIK)
-        response = make_response(jsonify(data))
-        
-        # Tarayıcıya ve Vercel'e "Sakın hafızaya alma, her seferinde taze veri getir" diyoruz.
-        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate, max-age=0'
+        # ?since=<sürüm> verilirse sadece değişen araçları gönder
+        since = request.args.get('since', type=int)
+        if since is not None:
+            response = delta_response(build_delta(since, request.args.get('epoch')))
+        elif any(arg in request.args for arg in VEHICLE_FILTER_ARGS):
+            try:
+                total, page = filter_vehicles(request.args)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            response = orjson_response(page)
+            response.headers['X-Total-Count'] = str(total)
+        else:
+            response = snapshot_response()
+            response.headers['X-Snapshot-Version'] = str(GLOBAL_CACHE["version"])
+            response.headers['X-Snapshot-Epoch'] = SNAPSHOT_EPOCH
+
+        # Yenileme sürerken eski veri sunulabilir; istemci yaşını görebilsin
+        response.headers['X-Snapshot-Age'] = f"{max(0.0, time.time() - GLOBAL_CACHE['last_update']):.1f}"
+        response.headers['X-Snapshot-Source'] = GLOBAL_CACHE["source"] or "none"
+        # İstemci canlı akışı sadece sunucu destekliyorsa açar (Vercel'de polling)
+        response.headers['X-Live-Stream'] = '1' if STREAM_MAX_SUBSCRIBERS else '0'
+
+        # 2. Vercel CDN Cache Ayarı (ANLIK)
+        # Tarayıcı ve Vercel her seferinde sunucuya sorar; veri değişmediyse ETag ile 304 döner.
+        response.headers['Cache-Control'] = 'no-cache, must-revalidate, max-age=0'
         response.headers['Pragma'] = 'no-cache'
         response.headers['Expires'] = '0'
         
@@ -659,32 +2943,368 @@ def veriler():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# --- CANLI YAYIN (SSE) ---
+def stream_message(key, builder):
+    """Aynı anahtar için mesajı bir kez üretir; diğer aboneler hazır byte'ları alır."""
+    with STREAM_MESSAGES_LOCK:
+        message = STREAM_MESSAGES.get(key)
+        if message is None:
+            # Sadece güncel sürümün mesajlarını tut
+            version = key[-1]
+            for old_key in [k for k in STREAM_MESSAGES if k[-1] != version]:
+                del STREAM_MESSAGES[old_key]
+            message = builder()
+            STREAM_MESSAGES[key] = message
+    return message
+
+def sse_event(event, event_id, data):
+    return b"id: " + event_id.encode() + b"\nevent: " + event.encode() + b"\ndata: " + data + b"\n\n"
+
+def fleet_stream_message(since, version):
+    def build():
+        delta = build_delta(since)
+        return sse_event("delta", f"{SNAPSHOT_EPOCH}:{delta['version']}", delta_body(delta))
+    return stream_message(("fleet", since, version), build)
+
+def door_stream_message(door, version):
+    def build():
+        payload = {"door": door, "vehicle": lookup_vehicle(door)}
+        return sse_event("vehicle", f"{SNAPSHOT_EPOCH}:{version}", orjson.dumps(payload))
+    return stream_message(("door", door, version), build)
+
+def parse_stream_position():
+    """Last-Event-ID (yeniden bağlanma) veya ?since=&epoch= parametrelerinden başlangıç sürümünü okur."""
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    if ':' in last_event_id:
+        epoch, _, version = last_event_id.partition(':')
+        if epoch == SNAPSHOT_EPOCH and version.isdigit():
+            return int(version)
+        return None
+
+    since = request.args.get('since', type=int)
+    epoch = request.args.get('epoch')
+    if since is None or (epoch and epoch != SNAPSHOT_EPOCH):
+        return None
+    return since
+
+def stream_events(doors, since):
+    deadline = time.monotonic() + STREAM_MAX_SECONDS
+    last_sent = time.monotonic()
+    last_records = {}
+    version = since
+
+    yield b"retry: 2000\n\n"
+
+    while True:
+        current = GLOBAL_CACHE["version"]
+        if current != version or version is None:
+            if doors:
+                for door in doors:
+                    record = lookup_vehicle(door)
+                    if door in last_records and last_records[door] == record:
+                        continue
+                    last_records[door] = record
+                    yield door_stream_message(door, current)
+            else:
+                yield fleet_stream_message(version, current)
+            version = current
+            last_sent = time.monotonic()
+        elif time.monotonic() - last_sent >= STREAM_KEEPALIVE:
+            yield b": keepalive\n\n"
+            last_sent = time.monotonic()
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+
+        with STREAM_COND:
+            if GLOBAL_CACHE["version"] == version:
+                STREAM_COND.wait(timeout=min(CACHE_DURATION, remaining))
+
+        # Background worker çalışmıyorsa (Vercel) yenilemeyi akışlar tetikler (tek uçuş)
+        refresh_if_stale()
+
+@app.route('/api/stream')
+def stream():
+    """Her yenilemede tek bir mesaj iten Server-Sent Events akışı.
+
+    ?door=B-1234 (veya virgülle birden fazla) verilirse sadece o araçlar, yoksa tüm filo deltası gönderilir.
+    Abone sınırı (STREAM_MAX_SUBSCRIBERS) doluysa 503 döner; istemci /api/veriler?since= ile devam eder.
+    """
+    with STREAM_STATE["lock"]:
+        if STREAM_STATE["subscribers"] >= STREAM_MAX_SUBSCRIBERS:
+            response = jsonify({"error": "Live stream unavailable, poll /api/veriler?since="})
+            response.status_code = 503
+            response.headers['Retry-After'] = str(STREAM_MAX_SECONDS)
+            return response
+        STREAM_STATE["subscribers"] += 1
+
+    def release():
+        with STREAM_STATE["lock"]:
+            STREAM_STATE["subscribers"] -= 1
+
+    try:
+        doors = [d.strip().upper() for d in request.args.get('door', '').split(',') if d.strip()]
+        since = parse_stream_position()
+        response = Response(stream_with_context(stream_events(doors, since)), mimetype='text/event-stream')
+    except Exception:
+        release()
+        raise
+    # Yanıt kapanınca (akış bitti veya istemci koptu) yer boşalır
+    response.call_on_close(release)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def parse_float_args(*names):
+    try:
+        return [float(request.args[name]) for name in names]
+    except (KeyError, ValueError):
+        return None
+
+def select_fields(vehicles):
+    fields = [f.strip() for f in (request.args.get('fields') or '').split(',') if f.strip()]
+    if not fields: return vehicles
+    return [{f: v[f] for f in fields if f in v} for v in vehicles]
+
+@app.route('/api/vehicles/bbox')
+def get_vehicles_bbox():
+    """Harita görünümündeki araçlar.
+
+    ?bbox=batı,güney,doğu,kuzey (Leaflet toBBoxString sırası) veya ?south=&west=&north=&east=;
+    isteğe bağlı limit ve fields. Toplam eşleşme X-Total-Count başlığında.
+    """
+    refresh_if_stale()
+    if request.args.get('bbox'):
+        try:
+            west, south, east, north = (float(x) for x in request.args['bbox'].split(','))
+        except ValueError:
+            return jsonify({"error": "bbox must be west,south,east,north"}), 400
+    else:
+        bounds = parse_float_args('south', 'west', 'north', 'east')
+        if bounds is None:
+            return jsonify({"error": "bbox or south/west/north/east required"}), 400
+        south, west, north, east = bounds
+    if south > north or west > east:
+        return jsonify({"error": "invalid bbox"}), 400
+
+    try:
+        _, limit = parse_paging(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    matched = vehicles_in_bbox(south, west, north, east)
+    total = len(matched)
+    if limit is not None: matched = matched[:limit]
+
+    response = orjson_response(select_fields(matched))
+    response.headers['X-Total-Count'] = str(total)
+    return response
+
+@app.route('/api/vehicles/near')
+def get_vehicles_near():
+    """?lat=&lng=&k=10[&radius=metre] noktasına en yakın k araç, [{"distance", "vehicle"}]."""
+    refresh_if_stale()
+    point = parse_float_args('lat', 'lng')
+    if point is None:
+        return jsonify({"error": "lat and lng required"}), 400
+    k = request.args.get('k', default=NEAR_DEFAULT_K, type=int)
+    if k is not None and k < 0:
+        return jsonify({"error": "k must be non-negative"}), 400
+    k = max(1, min(k or NEAR_DEFAULT_K, NEAR_MAX_K))
+    radius = min(request.args.get('radius', default=NEAR_MAX_RADIUS, type=float) or NEAR_MAX_RADIUS, NEAR_MAX_RADIUS)
+
+    nearest = nearest_vehicles(point[0], point[1], k, radius)
+    vehicles = select_fields([v for _, v in nearest])
+    return orjson_response([{"distance": int(d), "vehicle": v} for (d, _), v in zip(nearest, vehicles)])
+
+@app.route('/api/vehicles/<door_number>')
+def get_vehicle(door_number):
+    """Tek bir aracın güncel kaydını indeksten döndürür."""
+    refresh_if_stale()
+    vehicle = lookup_vehicle(door_number)
+    if vehicle is None:
+        return jsonify({"error": "Vehicle not found"}), 404
+    return orjson_response(vehicle)
+
+@app.route('/api/vehicles')
+def get_vehicles():
+    """?doors=A,B,C için {kapı: kayıt veya null} döndürür."""
+    refresh_if_stale()
+    doors = [d.strip() for d in request.args.get('doors', '').split(',') if d.strip()]
+    if not doors:
+        return jsonify({"error": "doors required"}), 400
+    return orjson_response({door: lookup_vehicle(door) for door in doors})
+
+@app.route('/api/fleet-status')
+def fleet_status():
+    """Tüm filonun son yenilemede hesaplanan hareket durumu.
+
+    ?status=HAREKETLİ,DURUYOR ve ?doors=A,B ile süzülebilir; counts her zaman tüm filo içindir.
+    """
+    refresh_if_stale()
+    statuses = {s.strip() for s in request.args.get('status', '').split(',') if s.strip()}
+    doors = {d.strip().upper() for d in request.args.get('doors', '').split(',') if d.strip()}
+    body = FLEET_STATUS.report(statuses, doors)
+    if body is None:
+        return jsonify({"error": "Data not ready"}), 503
+    return app.response_class(body, mimetype='application/json')
+
+@app.route('/api/summary')
+def summary():
+    """Toplam/aktif/pasif/bayat sayıları ve şirket başına araç sayısı (filo listesi olmadan)."""
+    refresh_if_stale()
+    ensure_snapshot_parsed()
+    now = time.time()
+    payload = FLEET_SUMMARY.report(now)
+    payload["version"] = GLOBAL_CACHE["version"]
+    payload["lastUpdate"] = int(GLOBAL_CACHE["last_update"] or 0)
+    response = orjson_response(payload)
+    response.headers['Cache-Control'] = 'no-cache, must-revalidate, max-age=0'
+    return response
+
+@app.route('/api/metrics')
+def metrics():
+    """Prometheus metin formatında aşama/route gecikme histogramları, sayaçlar ve anlık değerler."""
+    now = time.time()
+    tasks = TASK_CACHE.stats()
+    with HISTORY_STORE.lock:
+        history_tracks, history_points = len(HISTORY_STORE.tracks), HISTORY_STORE.points
+    gauges = [
+        ("iett_snapshot_age_seconds", "Son başarılı yenilemeden bu yana geçen süre",
+         round(now - GLOBAL_CACHE["last_update"], 3) if GLOBAL_CACHE["last_update"] else -1),
+        ("iett_fleet_size", "Son anlık görüntüdeki araç sayısı", GLOBAL_CACHE["size"]),
+        ("iett_snapshot_version", "Anlık görüntü sürümü", GLOBAL_CACHE["version"]),
+        ("iett_refresh_in_flight", "Sürmekte olan yenileme (0/1)", int(REFRESH_STATE["in_flight"])),
+        ("iett_stream_subscribers", "Açık SSE akışı sayısı", STREAM_STATE["subscribers"]),
+        ("iett_refresh_last_ok", "Son yenileme başarılı mı (0/1)", int(bool(REFRESH_STATE["last_ok"]))),
+        ("iett_refresh_consecutive_errors", "Background worker ardışık hata sayısı", REFRESH_STATE["consecutive_errors"]),
+        ("iett_refresh_backoff_seconds", "Background worker şu anki bekleme süresi", REFRESH_STATE["backoff_seconds"]),
+        ("iett_poll_interval_seconds", "Yoklama zamanlayıcısının son seçtiği aralık",
+         POLL_SCHEDULER.decision["interval"] if POLL_SCHEDULER.decision else -1),
+        ("iett_poll_change_rate", "Saniyede değişen filo oranı (EWMA)", POLL_SCHEDULER.rate or 0),
+        ("iett_breaker_state", "Devre kesici (0 kapalı, 1 yarı açık, 2 açık)",
+         {"closed": 0, "half_open": 1, "open": 2}[POLL_SCHEDULER.state]),
+        ("iett_task_cache", "Görev önbelleği sayaçları", {
+            (("stat", key),): tasks[key] for key in ("entries", "hits", "misses", "coalesced", "evictions")
+        }),
+        ("iett_task_cache_hit_ratio", "Görev önbelleği isabet oranı", tasks["hit_rate"]),
+        ("iett_history_memory_tracks", "Bellekteki araç izi sayısı", history_tracks),
+        ("iett_history_memory_points", "Bellekteki geçmiş nokta sayısı", history_points),
+        ("iett_history_write_queue", "Yazılmayı bekleyen geçmiş grubu", HISTORY_WRITER.queue.qsize()),
+    ]
+    response = app.response_class(METRICS.render(gauges), mimetype='text/plain')
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
 @app.route('/api/tasks/<door_number>')
 def get_tasks(door_number):
     """Canlı görev listesini döndürür."""
-    raw_tasks = fetch_vehicle_tasks(door_number)
-    simple_tasks = simplify_tasks(raw_tasks)
+    simple_tasks = TASK_CACHE.get(door_number)
     return jsonify(simple_tasks)
 
+@app.route('/api/cache-stats')
+def cache_stats():
+    """Görev önbelleği isabet/ıska sayaçları (TTL ayarı için)."""
+    return jsonify({"tasks": TASK_CACHE.stats()})
 
-@app.route('/api/history/<door_number>')
-def get_history(door_number):
-    """Belirtilen araç için son X dakikalık hareket geçmişini döndürür."""
-    try:
-        minutes = request.args.get('minutes', default=15, type=int)
-    except Exception:
-        minutes = 15
+@app.route('/api/poll-scheduler')
+def poll_scheduler():
+    """Yoklama zamanlayıcısının son kararları ve devre kesici durumu.
 
+    Okuyucu süreçte zamanlayıcı fetcher'da çalıştığı için onun yazdığı rapor sunulur.
+    """
+    if PROCESS_ROLE == "reader":
+        try:
+            with open(POLL_SCHEDULER.report_path, "rb") as f:
+                return app.response_class(f.read(), mimetype='application/json')
+        except OSError:
+            return jsonify({"error": "Scheduler report not available yet"}), 503
+    return orjson_response(POLL_SCHEDULER.report())
+
+
+@app.route('/api/history')
+def get_history_bulk():
+    """?doors=A,B,C&minutes=5 ile birden çok aracın geçmişini tek sorguda döndürür."""
+    doors = [d.strip() for d in request.args.get('doors', '').split(',') if d.strip()]
+    if not doors:
+        return jsonify({"error": "doors required"}), 400
+    minutes = max(1, min(request.args.get('minutes', default=15, type=int) or 15, HISTORY_RETENTION_MINUTES))
+
+    history_map = get_history_points_bulk(doors, minutes)
+    for points in history_map.values():
+        for point, time_str in zip(points, history_time_strs([p["timestamp"] for p in points])):
+            point["time"] = time_str
+    return orjson_response(history_map)
+
+def parse_replay_time(value):
+    """Epoch saniye veya ISO tarih (saat dilimi yoksa TR, UTC+3); geçersizse ValueError."""
+    if value is None: return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        dt = datetime.fromisoformat(value)
+        if dt.tzinfo is None:
+            seconds = calendar.timegm(dt.timetuple()) - TR_UTC_OFFSET
+        else:
+            seconds = dt.timestamp()
+    # inf / 1e400 int'e çevrilemez, çok büyük değerler arşiv dosya adına (saat) dönüşemez
+    if not (math.isfinite(seconds) and 0 <= seconds <= REPLAY_MAX_TIMESTAMP): raise ValueError(value)
+    return int(seconds)
+
+@app.route('/api/replay')
+def replay():
+    """Arşivden ?from=&to=[&doors=A,B] aralığının izlerini kapı başına paralel diziler olarak akıtır.
+
+    Diziler numpy'dan doğrudan serileştirilir; tüm filo için bile nokta başına Python nesnesi üretilmez.
+    Arşiv yazıcıdan en fazla ARCHIVE_FLUSH_SECONDS geride gelir.
+    """
+    try:
+        start_ts = parse_replay_time(request.args.get('from'))
+        end_ts = parse_replay_time(request.args.get('to'))
+        if end_ts is None: end_ts = int(time.time())
+    except (ValueError, OverflowError):
+        return jsonify({"error": "from/to must be epoch seconds or ISO datetime"}), 400
+    if start_ts is None or start_ts > end_ts:
+        return jsonify({"error": "from required and must be <= to"}), 400
+    if end_ts - start_ts > REPLAY_MAX_SECONDS:
+        return jsonify({"error": f"range must be at most {REPLAY_MAX_SECONDS} seconds"}), 400
+    doors = [d.strip() for d in request.args.get('doors', '').split(',') if d.strip()] or None
+
+    tracks = TRACK_ARCHIVE.read(start_ts, end_ts, doors)
+
+    def generate():
+        yield orjson.dumps({"from": start_ts, "to": end_ts})[:-1] + b',"tracks":{'
+        for i, (door, (lat, lng, ts)) in enumerate(tracks.items()):
+            body = orjson.dumps({"lat": lat, "lng": lng, "timestamp": ts}, option=orjson.OPT_SERIALIZE_NUMPY)
+            yield (b',' if i else b'') + orjson.dumps(door) + b':' + body
+        yield b'}}'
+
+    return Response(generate(), mimetype='application/json')
 
+@app.route('/api/history/<door_number>')
+def get_history(door_number):
+    """Belirtilen araç için son X dakikalık hareket geçmişini döndürür.
 
+    ?max_points=180 (zaman dilimi seyreltmesi), ?tolerance=metre (Douglas-Peucker),
+    ?format=points|arrays|polyline.
+    """
+    minutes = request.args.get('minutes', default=15, type=int) or 15
+    max_points = max(2, min(request.args.get('max_points', default=180, type=int) or 180, HISTORY_MAX_POINTS_LIMIT))
+    tolerance = max(0.0, request.args.get('tolerance', default=0, type=float) or 0.0)
+    fmt = request.args.get('format', 'points')
+    if fmt not in HISTORY_FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(HISTORY_FORMATS)}"}), 400
 
-    history = get_history_points(door_number, minutes)
-    return jsonify(history)
+    history = format_history(*history_track(door_number, minutes, max_points, tolerance), fmt)
+    return orjson_response(history)
 
 # --- ADMIN API ---
 @app.route('/api/admin/users', methods=['GET'])
 @admin_required
 def get_users():
+    supabase = get_supabase()
     if not supabase:
         return jsonify({"error": "Supabase not connected"}), 500
     try:
@@ -696,6 +3316,7 @@ def get_users():
 @app.route('/api/admin/users', methods=['POST'])
 @admin_required
 def add_user():
+    supabase = get_supabase()
     if not supabase:
         return jsonify({"error": "Supabase not connected"}), 500
     
@@ -723,6 +3344,7 @@ def add_user():
 @app.route('/api/admin/users/<id>', methods=['DELETE'])
 @admin_required
 def delete_user(id):
+    supabase = get_supabase()
     if not supabase:
         return jsonify({"error": "Supabase not connected"}), 500
     try:
@@ -737,6 +3359,7 @@ def delete_user(id):
 @app.route('/api/admin/users/<id>/password', methods=['PUT'])
 @admin_required
 def update_user_password(id):
+    supabase = get_supabase()
     if not supabase:
         return jsonify({"error": "Supabase not connected"}), 500
     
@@ -757,6 +3380,7 @@ def update_user_password(id):
 @app.route('/api/admin/users/<id>/username', methods=['PUT'])
 @admin_required
 def update_user_username(id):
+    supabase = get_supabase()
     if not supabase:
         return jsonify({"error": "Supabase not connected"}), 500
     
@@ -780,3 +3404,99 @@ def update_user_username(id):
         return jsonify({"success": True, "data": response.data})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+# --- SÜREÇ YÖNETİMİ (--fetcher / --workers) ---
+SHARED_LISTEN_FD_ENV = 'SHARED_LISTEN_FD'
+
+def run_fetcher():
+    """Sadece IETT'yi yoklayıp nesil yayınlayan süreç; HTTP sunmaz, geçmişi tek başına yazar."""
+    SHARED_SNAPSHOT.open_writer()
+    # Kalıcı dosyadan yüklenen görüntü okuyuculara ilk canlı yenilemeyi beklemeden gider
+    if GLOBAL_CACHE["data"]:
+        SHARED_SNAPSHOT.publish()
+    HISTORY_WRITER.start()
+    start_background_workers()
+    print(f"Fetcher started, publishing generations to {SHARED_SNAPSHOT_DIR}")
+    while True:
+        time.sleep(3600)
+
+def serve_workers(workers, host, port):
+    """Bir fetcher ve aynı dinleme soketini paylaşan N okuyucu süreç başlatır; düşeni yeniden başlatır.
+
+    Çekirdek bağlantıları okuyucular arasında dağıtır; IETT yükü okuyucu sayısından bağımsızdır.
+    """
+    import signal
+    import socket
+    import subprocess
+
+    listener = socket.create_server((host, port), backlog=1024)
+    listener.set_inheritable(True)
+    script = os.path.abspath(__file__)
+
+    def spawn(role):
+        env = dict(os.environ, IETT_PROCESS_ROLE=role, SHARED_SNAPSHOT_DIR=SHARED_SNAPSHOT_DIR)
+        if role == "fetcher":
+            return subprocess.Popen([sys.executable, script, "--fetcher"], env=env)
+        env[SHARED_LISTEN_FD_ENV] = str(listener.fileno())
+        return subprocess.Popen([sys.executable, script], env=env, pass_fds=(listener.fileno(),))
+
+    children = [["fetcher", spawn("fetcher")]] + [["reader", spawn("reader")] for _ in range(workers)]
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    print(f"Sunucu başlatılıyor: http://127.0.0.1:{port} (1 fetcher + {workers} okuyucu süreç)")
+    try:
+        while not stopping.wait(1.0):
+            for child in children:
+                role, proc = child
+                if proc.poll() is not None:
+                    print(f"[WORKERS] {role} (pid {proc.pid}) exited with {proc.returncode}, restarting")
+                    child[1] = spawn(role)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for _, proc in children:
+            proc.terminate()
+        for _, proc in children:
+            try:
+                proc.wait(10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+# Soğuk başlangıç: son iyi anlık görüntü varsa ilk istek IETT'yi beklemez
+load_persisted_snapshot()
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="İETT filo takip sunucusu")
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WORKERS', 0)),
+                        help="N > 0: bir fetcher + N okuyucu süreç (paylaşılan nesil dosyaları)")
+    parser.add_argument('--fetcher', action='store_true', help="sadece fetcher sürecini çalıştır (HTTP yok)")
+    args = parser.parse_args()
+
+    host = os.getenv('HOST', '0.0.0.0')
+    port = int(os.getenv('PORT', 5000))
+    # SSE akışları birer thread tutar, varsayılan 4 thread yetmez
+    threads = int(os.getenv('WAITRESS_THREADS', 32))
+
+    if args.fetcher:
+        PROCESS_ROLE = "fetcher"
+        run_fetcher()
+    elif args.workers > 0 and PROCESS_ROLE == "standalone":
+        serve_workers(args.workers, host, port)
+    else:
+        from waitress import serve
+
+        if PROCESS_ROLE == "reader":
+            start_background_workers()
+            listen_fd = os.getenv(SHARED_LISTEN_FD_ENV)
+            if listen_fd:
+                import socket
+                serve(app, sockets=[socket.socket(fileno=int(listen_fd))], threads=threads)
+            else:
+                serve(app, host=host, port=port, threads=threads)
+        else:
+            HISTORY_WRITER.start()
+            start_background_workers()
+            print(f"Sunucu başlatılıyor: http://127.0.0.1:{port}")
+            serve(app, host=host, port=port, threads=threads)
@@ -0,0 +1,211 @@
+"""IETT şifreli API'sinin yerel taklidi (benchmark ve çevrimdışı geliştirme için).
+
+Gerçek uçlarla aynı çerçeve: pubkey (base64 DER), istemci AES-256 anahtarını RSA-OAEP (SHA256)
+ile şifreleyip encKey olarak gönderir, yanıt {"iv", "data": base64(ciphertext + tag)} AES-GCM.
+
+Tek başına çalıştırma:
+    python backend/bench/fake_upstream.py --fleet 5000 --port 5055
+    IETT_BASE_URL=http://127.0.0.1:5055 python backend/app.py
+"""
+import argparse
+import base64
+import random
+import threading
+import time
+
+import numpy as np
+import orjson
+from Crypto.Cipher import AES, PKCS1_OAEP
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import RSA
+from Crypto.Random import get_random_bytes
+from flask import Flask, request
+from werkzeug.serving import make_server
+
+OPERATORS = [
+    "İETT", "ÖZULAŞ A.Ş", "İSTANBUL HALK ULAŞIM TİC.A.Ş", "MAVİ MARMARA", "İST HALK OTOBÜS",
+    "ELİT KARAYOLU", "YENİ İSTANBUL ÖZEL HALK OTOBÜSLERİ", "ÖZTAŞ ULAŞIM", "BAĞIMSIZ",
+]
+LINES = [
+    ("15F", "15F - BEYKOZ / KADIKÖY"), ("500T", "500T - TUZLA / CEVİZLİBAĞ"),
+    ("34AS", "34AS - AVCILAR / SÖĞÜTLÜÇEŞME"), ("11ÜS", "11ÜS - ÜSKÜDAR / SULTANBEYLİ"),
+    ("25G", "25G - SARIYER / TOPKAPI"), ("76D", "76D - BEYLİKDÜZÜ / TAKSİM"),
+]
+
+# İstanbul çevresi
+LAT_RANGE = (40.85, 41.25)
+LNG_RANGE = (28.55, 29.40)
+
+
+class SyntheticFleet:
+    """Sabit araç kayıtları + her istekte ilerletilen konumlar.
+
+    Araçların bir kısmı durur, bir kısmı saatlerce/günlerce eski zaman bildirir, birkaçının
+    tarihi hiç yoktur; böylece aktif/pasif/bayat dalları da çalışır.
+    """
+
+    def __init__(self, size, seed=42):
+        rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+        self.lat = rng.uniform(*LAT_RANGE, size)
+        self.lng = rng.uniform(*LNG_RANGE, size)
+        moving = rng.random(size) < 0.7
+        # derece / saniye (~0-15 m/s)
+        self.v_lat = np.where(moving, rng.normal(0, 6e-5, size), 0.0)
+        self.v_lng = np.where(moving, rng.normal(0, 8e-5, size), 0.0)
+        self.speed = np.where(moving, rng.uniform(5, 60, size).round(), rng.choice([0, 0, 0, 2, 5], size))
+        self.lag = np.where(rng.random(size) < 0.9, rng.integers(0, 30, size), 0)
+        lag_kind = rng.random(size)
+        self.lag = np.where(lag_kind > 0.95, rng.integers(3600, 6 * 3600, size), self.lag)
+        self.lag = np.where(lag_kind > 0.98, rng.integers(2 * 86400, 10 * 86400, size), self.lag)
+        self.no_time = rng.random(size) < 0.01
+        self.last_step = time.time()
+
+        self.records = []
+        for i in range(size):
+            prefix = "ABCKOS"[i % 6]
+            door = f"{prefix}-{i:04d}" if i < 10000 else f"{prefix}{i}"
+            self.records.append({
+                "vehicleDoorCode": door,
+                "busDoorNumber": door,
+                "numberPlate": f"34 {prefix}{i % 100:02d} {1000 + i % 9000}",
+                "operatorType": OPERATORS[i % len(OPERATORS)],
+                "brandName": random.Random(i).choice(["MERCEDES", "OTOKAR", "KARSAN", "BMC"]),
+                "modelYear": 2010 + i % 15,
+                "vehicleType": "SOLO",
+                "seatingCapacity": 30,
+                "fullCapacity": 90,
+                "hasWifi": bool(i % 2),
+                "hasUsbCharger": bool(i % 3),
+                "isAirConditioned": True,
+                "accessibility": True,
+            })
+
+    @property
+    def doors(self):
+        return [r["vehicleDoorCode"] for r in self.records]
+
+    def snapshot(self):
+        with self.lock:
+            now = time.time()
+            dt = now - self.last_step
+            self.last_step = now
+            self.lat += self.v_lat * dt
+            self.lng += self.v_lng * dt
+            # Alandan çıkanlar geri döner
+            for pos, vel, (low, high) in ((self.lat, self.v_lat, LAT_RANGE), (self.lng, self.v_lng, LNG_RANGE)):
+                out = (pos < low) | (pos > high)
+                vel[out] *= -1
+                np.clip(pos, low, high, out=pos)
+
+            stamps = (int(now) - self.lag).tolist()
+            dates = {}
+            for record, lat, lng, speed, ts, no_time in zip(
+                self.records, self.lat.tolist(), self.lng.tolist(), self.speed.tolist(), stamps, self.no_time.tolist()
+            ):
+                record["latitude"] = round(lat, 6)
+                record["longitude"] = round(lng, 6)
+                record["speed"] = speed
+                if no_time:
+                    record["lastLocationDate"] = None
+                    record["lastLocationTime"] = None
+                    continue
+                day = ts - ts % 86400
+                date_str = dates.get(day)
+                if date_str is None:
+                    date_str = dates[day] = time.strftime("%Y-%m-%dT00:00:00", time.gmtime(day))
+                seconds = ts - day
+                record["lastLocationDate"] = date_str
+                record["lastLocationTime"] = f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+            return orjson.dumps({"data": self.records})
+
+
+def make_tasks(door):
+    """Kapı için o güne ait birkaç görev (simplify_tasks'ın okuduğu alanlar)."""
+    rng = random.Random(door)
+    if rng.random() < 0.2:
+        return []
+    start = int(time.time() // 86400 * 86400) + 4 * 3600
+    tasks = []
+    for n in range(rng.randint(1, 6)):
+        code, name = rng.choice(LINES)
+        planned = (start + n * 5400 + rng.randint(0, 900)) * 1000
+        tasks.append({
+            "lineCode": code,
+            "lineName": name,
+            "routeDirection": rng.randint(0, 1),
+            "plannedStartTime": planned,
+            "approximateStartTime": planned + rng.randint(0, 300) * 1000,
+            "driverRegisterNo": str(rng.randint(10000, 99999)),
+        })
+    return tasks
+
+
+def create_app(fleet_size, task_latency=0.0, fleet_latency=0.0):
+    key = RSA.generate(2048)
+    oaep = PKCS1_OAEP.new(key, hashAlgo=SHA256)
+    pubkey_b64 = base64.b64encode(key.publickey().export_key("DER")).decode()
+    fleet = SyntheticFleet(fleet_size)
+    session_keys = {}
+    stats = {"pubkey": 0, "fleet": 0, "tasks": 0, "rsa_decrypts": 0}
+
+    upstream = Flask("fake_upstream")
+    upstream.config["fleet"] = fleet
+    upstream.config["stats"] = stats
+
+    def session_key():
+        enc_key = (request.get_json(silent=True) or {}).get("encKey")
+        aes_key = session_keys.get(enc_key)
+        if aes_key is None:
+            stats["rsa_decrypts"] += 1
+            aes_key = session_keys[enc_key] = oaep.decrypt(base64.b64decode(enc_key))
+        return aes_key
+
+    def encrypted(aes_key, body):
+        iv = get_random_bytes(12)
+        ciphertext, tag = AES.new(aes_key, AES.MODE_GCM, nonce=iv).encrypt_and_digest(body)
+        return upstream.response_class(
+            orjson.dumps({"iv": base64.b64encode(iv).decode(), "data": base64.b64encode(ciphertext + tag).decode()}),
+            mimetype="application/json",
+        )
+
+    @upstream.get("/api/task/crypto/pubkey")
+    def pubkey():
+        stats["pubkey"] += 1
+        return {"key": pubkey_b64}
+
+    @upstream.post("/api/task/bus-fleet/buses")
+    def buses():
+        stats["fleet"] += 1
+        if fleet_latency: time.sleep(fleet_latency)
+        return encrypted(session_key(), fleet.snapshot())
+
+    @upstream.post("/api/task/getCarTasks/<door>")
+    def car_tasks(door):
+        stats["tasks"] += 1
+        if task_latency: time.sleep(task_latency)
+        return encrypted(session_key(), orjson.dumps(make_tasks(door)))
+
+    return upstream
+
+
+def start(fleet_size, host="127.0.0.1", port=0, **kwargs):
+    """Sunucuyu arka plan thread'inde başlatır; (sunucu, taban URL, flask app) döner."""
+    upstream = create_app(fleet_size, **kwargs)
+    server = make_server(host, port, upstream, threaded=True)
+    threading.Thread(target=server.serve_forever, name="fake-upstream", daemon=True).start()
+    return server, f"http://{host}:{server.server_port}", upstream
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fleet", type=int, default=5000)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--task-latency", type=float, default=0.0, help="getCarTasks yapay gecikmesi (sn)")
+    parser.add_argument("--fleet-latency", type=float, default=0.0, help="bus-fleet yapay gecikmesi (sn)")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, create_app(args.fleet, args.task_latency, args.fleet_latency), threaded=True)
+    print(f"Fake IETT upstream: http://{args.host}:{server.server_port} ({args.fleet} araç)")
+    server.serve_forever()
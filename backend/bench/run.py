@@ -0,0 +1,291 @@
+"""Backend benchmark: sahte IETT sunucusuna (fake_upstream.py) karşı ölçüm yapar, sonucu JSON'a yazar.
+
+Ölçülenler:
+    refresh        fetch_from_iett_internal (HTTP + AES-GCM + normalizasyon) ve publish_snapshot süreleri
+    veriler        /api/veriler istek/sn ve gecikme yüzdelikleri (ayrı süreçte waitress, eşzamanlı istemciler)
+    batch_analyze  N kapı için iter_batch_results (soğuk ve ılık görev önbelleği)
+    history        bellek / SQLite / toplu geçmiş sorguları ve arşivden tüm filo replay
+
+Kullanım (depo kökünden):
+    python backend/bench/run.py --fleet 5000 --output bench_results.json
+
+Gerekli ayarlar (IETT_BASE_URL, HISTORY_DB, HISTORY_ARCHIVE_DIR) geçici dizine yönlendirilir;
+gerçek IETT'ye ve yerel geçmiş veritabanına dokunulmaz.
+"""
+import argparse
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import orjson
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import fake_upstream  # noqa: E402
+
+
+def summarize(samples):
+    """Saniye cinsinden örneklerden milisaniye istatistikleri."""
+    if not samples:
+        return {"count": 0}
+    ms = np.asarray(samples) * 1000
+    return {
+        "count": int(len(ms)),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p90_ms": round(float(np.percentile(ms, 90)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def seed_history(backend, doors, minutes, interval):
+    """Son N dakika için sentetik geçmiş: bellek halkaları, SQLite ve arşiv aynı kayıtlarla dolar."""
+    now = int(time.time())
+    start = now - minutes * 60
+    backend.HISTORY_STORE.covered_from = start
+    rng = np.random.default_rng(7)
+    lat = rng.uniform(*fake_upstream.LAT_RANGE, len(doors))
+    lng = rng.uniform(*fake_upstream.LNG_RANGE, len(doors))
+    total = 0
+    for ts in range(start, now, interval):
+        lat += rng.normal(0, 3e-4, len(doors))
+        lng += rng.normal(0, 3e-4, len(doors))
+        records = list(zip(doors, lat.tolist(), lng.tolist(), [ts] * len(doors)))
+        backend.HISTORY_STORE.add_many(records)
+        backend.save_data_to_db(records)
+        total += len(records)
+    backend.HISTORY_WRITER.flush()
+    backend.TRACK_ARCHIVE.flush()
+    return total
+
+
+def bench_refresh(backend, rounds):
+    fetch, publish, sizes = [], [], []
+    for _ in range(rounds):
+        fetch_s, data = timed(backend.fetch_from_iett_internal)
+        publish_s, _ = timed(backend.publish_snapshot, data)
+        fetch.append(fetch_s)
+        publish.append(publish_s)
+        sizes.append(len(data))
+        time.sleep(0.2)
+    return {
+        "rounds": rounds,
+        "vehicles": max(sizes) if sizes else 0,
+        "fetch": summarize(fetch),
+        "publish": summarize(publish),
+        "total": summarize([a + b for a, b in zip(fetch, publish)]),
+    }
+
+
+def start_server(base_url, workdir, port):
+    """app.py'yi gerçek dağıtımdaki gibi (waitress + background worker) ayrı süreçte çalıştırır."""
+    env = dict(
+        os.environ,
+        IETT_BASE_URL=base_url,
+        HISTORY_DB=os.path.join(workdir, "server_history.db"),
+        HISTORY_ARCHIVE_DIR=os.path.join(workdir, "server_archive"),
+        PORT=str(port),
+        HOST="127.0.0.1",
+    )
+    log = open(os.path.join(workdir, "server.log"), "wb")
+    proc = subprocess.Popen([sys.executable, os.path.join(BACKEND_DIR, "app.py")], cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited, see {log.name}")
+        try:
+            if requests.get(f"{url}/api/summary", timeout=5).json().get("total"):
+                return proc, url
+        except (requests.RequestException, ValueError):
+            pass
+        time.sleep(0.5)
+    proc.kill()
+    raise RuntimeError("server did not become ready")
+
+
+def load(url, scenario, concurrency, duration):
+    """concurrency thread ile duration boyunca istek atar; gövdeler açılmadan okunur.
+
+    full: her istek tam gövde, etag: istemci son ETag'i If-None-Match ile gönderir (304 yolu).
+    """
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    transferred = [0] * concurrency
+    stop_at = time.perf_counter() + duration
+
+    def client(i):
+        session = requests.Session()
+        etag = None
+        while time.perf_counter() < stop_at:
+            headers = {"Accept-Encoding": "br, gzip"}
+            if scenario == "etag" and etag:
+                headers["If-None-Match"] = etag
+            start = time.perf_counter()
+            try:
+                resp = session.get(f"{url}/api/veriler", headers=headers, stream=True, timeout=30)
+                body = resp.raw.read(decode_content=False)
+                latencies[i].append(time.perf_counter() - start)
+                transferred[i] += len(body)
+                if resp.status_code not in (200, 304):
+                    errors[i] += 1
+                etag = resp.headers.get("ETag", etag)
+            except requests.RequestException:
+                errors[i] += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - started
+
+    samples = [s for per_thread in latencies for s in per_thread]
+    return {
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 3),
+        "requests": len(samples),
+        "errors": sum(errors),
+        "rps": round(len(samples) / elapsed, 1),
+        "bytes_per_request": int(sum(transferred) / max(1, len(samples))),
+        "latency": summarize(samples),
+    }
+
+
+def bench_veriler(base_url, workdir, args):
+    proc, url = start_server(base_url, workdir, args.server_port)
+    try:
+        return {scenario: load(url, scenario, args.concurrency, args.duration) for scenario in ("full", "etag")}
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def bench_batch(backend, doors):
+    backend.TASK_CACHE.entries.clear()
+    cold_s, cold = timed(lambda: list(backend.iter_batch_results(doors)))
+    warm_s, warm = timed(lambda: list(backend.iter_batch_results(doors)))
+    timeouts = sum(1 for _, row in cold if row["vehicle_status"] == "ZAMAN AŞIMI")
+    return {
+        "doors": len(doors),
+        "cold_s": round(cold_s, 3),
+        "warm_s": round(warm_s, 3),
+        "cold_per_door_ms": round(cold_s * 1000 / max(1, len(doors)), 3),
+        "warm_per_door_ms": round(warm_s * 1000 / max(1, len(doors)), 3),
+        "timeouts": timeouts,
+    }
+
+
+def bench_history(backend, doors, minutes, rounds):
+    sample = doors[:rounds]
+    memory = [timed(backend.get_history_points, door, 5)[0] for door in sample]
+    memory_long = [timed(backend.get_history_points, door, minutes)[0] for door in sample]
+    cutoff = int(time.time()) - minutes * 60
+    sqlite = [timed(backend.query_history_db, door, cutoff)[0] for door in sample]
+    bulk = [timed(backend.get_history_points_bulk, doors[i:i + 100], 5)[0] for i in range(0, min(len(doors), 100 * 10), 100)]
+    replay_s, tracks = timed(backend.TRACK_ARCHIVE.read, cutoff, int(time.time()))
+    return {
+        "memory_5min": summarize(memory),
+        f"memory_{minutes}min": summarize(memory_long),
+        f"sqlite_{minutes}min": summarize(sqlite),
+        "bulk_100_doors_5min": summarize(bulk),
+        "archive_replay_fleet": {
+            "seconds": round(replay_s, 3),
+            "doors": len(tracks),
+            "points": int(sum(len(track[2]) for track in tracks.values())),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fleet", type=int, default=5000, help="sentetik araç sayısı (1k-20k)")
+    parser.add_argument("--refreshes", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="/api/veriler senaryosu başına saniye")
+    parser.add_argument("--batch-doors", type=int, default=200)
+    parser.add_argument("--task-latency", type=float, default=0.05, help="sahte getCarTasks gecikmesi (sn)")
+    parser.add_argument("--history-minutes", type=int, default=30)
+    parser.add_argument("--history-interval", type=int, default=10, help="sentetik geçmiş nokta aralığı (sn)")
+    parser.add_argument("--history-rounds", type=int, default=200)
+    parser.add_argument("--server-port", type=int, default=5077)
+    parser.add_argument("--skip", default="", help="virgülle: refresh,veriler,batch,history")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+    skip = {s.strip() for s in args.skip.split(",") if s.strip()}
+
+    server, base_url, upstream = fake_upstream.start(args.fleet, task_latency=args.task_latency)
+    workdir = tempfile.mkdtemp(prefix="iett-bench-")
+    os.environ.update(
+        IETT_BASE_URL=base_url,
+        HISTORY_DB=os.path.join(workdir, "history.db"),
+        HISTORY_ARCHIVE_DIR=os.path.join(workdir, "archive"),
+    )
+    import app as backend
+    # Yenilemeleri harness sürer; istek yolu background worker başlatmasın
+    backend.REFRESH_STATE["workers_started"] = True
+    doors = upstream.config["fleet"].doors
+
+    results = {
+        "meta": {
+            "timestamp": int(time.time()),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+    }
+
+    if "history" not in skip:
+        print(f"[bench] seeding {args.history_minutes} min of history for {len(doors)} doors...")
+        results["history_seeded_points"] = seed_history(backend, doors, args.history_minutes, args.history_interval)
+    if "refresh" not in skip or "batch" not in skip:
+        print("[bench] refresh...")
+        results["refresh"] = bench_refresh(backend, args.refreshes if "refresh" not in skip else 1)
+    if "batch" not in skip:
+        print("[bench] batch_analyze...")
+        results["batch_analyze"] = bench_batch(backend, doors[:args.batch_doors])
+    if "history" not in skip:
+        print("[bench] history...")
+        results["history"] = bench_history(backend, doors, args.history_minutes, args.history_rounds)
+    if "veriler" not in skip:
+        print("[bench] /api/veriler...")
+        results["veriler"] = bench_veriler(base_url, workdir, args)
+
+    results["upstream_calls"] = dict(upstream.config["stats"])
+    server.shutdown()
+
+    with open(args.output, "wb") as f:
+        f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
+    print(orjson.dumps(results, option=orjson.OPT_INDENT_2).decode())
+    print(f"[bench] results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""Soğuk başlangıç benchmark'ı: her turda yeni bir süreçte app import edilir ve ilk /api/veriler sunulur.
+
+Senaryolar:
+    persisted  kalıcı anlık görüntü (.snapshot) hazır; ilk yanıt IETT'yi beklemeden dosyadan gelir
+    cold       dosya yok; ilk yanıt sahte IETT'den (fake_upstream.py) tam yenilemeyi bekler
+
+Her tur için import süresi, ilk isteğin süresi ve import sonrası yüklenmiş ağır modüller ölçülür.
+persisted medyanı (import + ilk istek) --budget-ms'i, cold medyanı --cold-budget-ms'i aşarsa
+ya da ertelenmesi gereken bir modül (supabase, Crypto, waitress, numpy, requests) import
+sırasında yüklenirse çıkış kodu 1 olur. cold, /tmp'nin silindiği Vercel soğuk başlangıcıdır;
+IETT tur süresini de içerdiği için bütçesi daha geniştir.
+
+Kullanım (depo kökünden):
+    python backend/bench/startup.py --rounds 7 --budget-ms 600 --cold-budget-ms 1500 --output startup_results.json
+"""
+import argparse
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import orjson
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import fake_upstream  # noqa: E402
+
+# İlk /api/veriler yanıtından önce yüklenmemesi gerekenler
+DEFERRED_MODULES = ("supabase", "Crypto", "waitress", "numpy", "requests")
+
+# Ölçülen süreçte çalışan kod; sonucu son satırda JSON olarak basar
+PROBE = """
+import sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+loaded = [m for m in {modules!r} if m in sys.modules]
+resp = app.app.test_client().get('/api/veriler', headers={{'Accept-Encoding': 'br, gzip'}})
+body = resp.get_data()
+done = time.perf_counter()
+import orjson
+print(orjson.dumps({{
+    'import_ms': (imported - started) * 1000,
+    'first_request_ms': (done - imported) * 1000,
+    'status': resp.status_code,
+    'source': resp.headers.get('X-Snapshot-Source'),
+    'bytes': len(body),
+    'loaded_at_import': loaded,
+}}).decode())
+"""
+
+
+def prepare_snapshot(base_url, workdir):
+    """Sahte IETT'den bir yenileme yapıp kalıcı anlık görüntüyü workdir'e yazar."""
+    os.environ.update(
+        IETT_BASE_URL=base_url,
+        HISTORY_DB=os.path.join(workdir, "seed_history.db"),
+        HISTORY_ARCHIVE_DIR=os.path.join(workdir, "seed_archive"),
+    )
+    import app as backend
+    backend.REFRESH_STATE["workers_started"] = True
+    if not backend.refresh_snapshot(wait=True):
+        raise RuntimeError("seed refresh failed")
+    # Yenileme arka planda bir kayıt başlatmış olabilir; bu çağrı kaydetme kilidinde onu bekler
+    backend.save_persisted_snapshot()
+    return backend.SNAPSHOT_FILE
+
+
+def run_round(base_url, workdir, snapshot):
+    """Yeni bir süreçte PROBE'u çalıştırır; süreç toplam süresi dahil ölçümleri döner."""
+    round_dir = tempfile.mkdtemp(dir=workdir)
+    history_db = os.path.join(round_dir, "history.db")
+    if snapshot:
+        shutil.copy(snapshot, history_db + ".snapshot")
+    env = dict(
+        os.environ,
+        IETT_BASE_URL=base_url,
+        HISTORY_DB=history_db,
+        HISTORY_ARCHIVE_DIR=os.path.join(round_dir, "archive"),
+    )
+    env.pop("SNAPSHOT_FILE", None)
+    started = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE.format(modules=DEFERRED_MODULES)],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, timeout=120,
+    )
+    elapsed = time.perf_counter() - started
+    if out.returncode != 0:
+        raise RuntimeError(f"probe failed:\n{out.stderr}")
+    result = orjson.loads(out.stdout.strip().splitlines()[-1])
+    result["process_ms"] = elapsed * 1000
+    result["startup_ms"] = result["import_ms"] + result["first_request_ms"]
+    return result
+
+
+def summarize(rounds):
+    def stats(key):
+        values = [r[key] for r in rounds]
+        return {"median": round(statistics.median(values), 1), "min": round(min(values), 1), "max": round(max(values), 1)}
+
+    return {
+        "rounds": len(rounds),
+        "import_ms": stats("import_ms"),
+        "first_request_ms": stats("first_request_ms"),
+        "startup_ms": stats("startup_ms"),
+        "process_ms": stats("process_ms"),
+        "statuses": sorted({r["status"] for r in rounds}),
+        "sources": sorted({str(r["source"]) for r in rounds}),
+        "loaded_at_import": sorted({m for r in rounds for m in r["loaded_at_import"]}),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fleet", type=int, default=5000, help="sentetik araç sayısı")
+    parser.add_argument("--rounds", type=int, default=7)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("STARTUP_BUDGET_MS", 600)),
+                        help="persisted senaryosu medyan import + ilk istek bütçesi (STARTUP_BUDGET_MS)")
+    parser.add_argument("--cold-budget-ms", type=float, default=float(os.getenv("COLD_STARTUP_BUDGET_MS", 1500)),
+                        help="cold senaryosu medyan import + ilk istek bütçesi (COLD_STARTUP_BUDGET_MS)")
+    parser.add_argument("--skip-cold", action="store_true", help="cold senaryosunu atla")
+    parser.add_argument("--output", default="startup_results.json")
+    args = parser.parse_args()
+
+    server, base_url, _ = fake_upstream.start(args.fleet)
+    workdir = tempfile.mkdtemp(prefix="iett-startup-")
+    try:
+        print("[startup] seeding snapshot...")
+        snapshot = prepare_snapshot(base_url, workdir)
+        scenarios = {"persisted": snapshot}
+        if not args.skip_cold:
+            scenarios["cold"] = None
+
+        results = {
+            "meta": {
+                "timestamp": int(time.time()),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "args": vars(args),
+            },
+        }
+        for name, path in scenarios.items():
+            print(f"[startup] {name} x{args.rounds}...")
+            results[name] = summarize([run_round(base_url, workdir, path) for _ in range(args.rounds)])
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    persisted = results["persisted"]
+    failures = []
+    if persisted["startup_ms"]["median"] > args.budget_ms:
+        failures.append(f"persisted startup median {persisted['startup_ms']['median']} ms > budget {args.budget_ms} ms")
+    if persisted["loaded_at_import"]:
+        failures.append(f"deferred modules loaded at import: {', '.join(persisted['loaded_at_import'])}")
+    if persisted["sources"] != ["persisted"] or persisted["statuses"] != [200]:
+        failures.append(f"first response not served from snapshot: {persisted['statuses']} {persisted['sources']}")
+    cold = results.get("cold")
+    if cold:
+        if cold["startup_ms"]["median"] > args.cold_budget_ms:
+            failures.append(f"cold startup median {cold['startup_ms']['median']} ms > budget {args.cold_budget_ms} ms")
+        if cold["sources"] != ["live"] or cold["statuses"] != [200]:
+            failures.append(f"cold first response not served live: {cold['statuses']} {cold['sources']}")
+    results["budget_ms"] = args.budget_ms
+    results["cold_budget_ms"] = args.cold_budget_ms
+    results["failures"] = failures
+
+    with open(args.output, "wb") as f:
+        f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
+    print(orjson.dumps(results, option=orjson.OPT_INDENT_2).decode())
+    for failure in failures:
+        print(f"[startup] FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
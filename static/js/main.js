@@ -14,11 +14,19 @@ let staleOnly = false;
 let currentViewingDoor = null; // Haritası açık olan araç
 const localVehicleHistory = {}; // Frontend-side history cache
 
+// Delta beslemesi: sunucudaki snapshot sürümü ve kapı kodu -> araç haritası
+let snapshotVersion = 0;
+let snapshotEpoch = null;
+const vehicleMap = new Map();
+
 // Harita değişkenleri
 let map = null;
 let polyline = null;
 
 let markers = [];
+let viewportLayer = null; // Görünümdeki diğer araçlar (/api/vehicles/bbox)
+let viewportRequestId = 0;
+const VIEWPORT_MIN_ZOOM = 13;
 let cachedBackendHistory = []; // Cache for backend history to avoid re-fetching on live update
 
 // Safe Storage Wrapper
@@ -110,20 +118,40 @@ updateClock(); setInterval(updateClock, 1000);
 async function fetchData() {
     document.getElementById('spinner').classList.add('active');
     try {
-        const response = await apiFetch('/api/veriler?t=' + Date.now());
+        // Sadece son sürümden bu yana değişen araçları iste
+        let url = `/api/veriler?since=${snapshotVersion}&t=${Date.now()}`;
+        if (snapshotEpoch) url += `&epoch=${snapshotEpoch}`;
+
+        const response = await apiFetch(url);
         if (!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
+        liveStreamSupported = response.headers.get('X-Live-Stream') === '1';
         const raw = await response.text();
         // Check if response is empty or just whitespace
-        if (!raw || raw.trim().length === 0) {
-            allVehicles = [];
-        } else {
-            allVehicles = JSON.parse(raw);
+        if (raw && raw.trim().length > 0) {
+            applySnapshotDelta(JSON.parse(raw));
         }
 
-        if (!Array.isArray(allVehicles)) allVehicles = [];
+        onVehiclesUpdated();
+    } catch (error) {
+        console.warn('Veri çekme hatası (Geçici):', error);
+        setPulseError();
+    } finally {
+        setTimeout(() => document.getElementById('spinner').classList.remove('active'), 1000);
+    }
+}
+
+function setPulseError() {
+    const pulseDot = document.getElementById('pulseDot');
+    const pulseText = document.getElementById('pulseText');
+    if (pulseDot) { pulseDot.classList.add('error'); }
+    if (pulseText) { pulseText.innerText = 'VERİ KESİNTİSİ'; pulseText.style.color = '#ef4444'; }
+}
 
+// Yeni veri geldiğinde (polling veya canlı akış) listeyi ve haritayı günceller
+function onVehiclesUpdated() {
+    try {
         // PULSE SUCCESS
         const pulseDot = document.getElementById('pulseDot');
         const pulseText = document.getElementById('pulseText');
@@ -171,17 +199,63 @@ async function fetchData() {
         }
 
     } catch (error) {
-        console.warn('Veri çekme hatası (Geçici):', error);
-        // PULSE ERROR
-        const pulseDot = document.getElementById('pulseDot');
-        const pulseText = document.getElementById('pulseText');
-        if (pulseDot) { pulseDot.classList.add('error'); }
-        if (pulseText) { pulseText.innerText = 'VERİ KESİNTİSİ'; pulseText.style.color = '#ef4444'; }
-    } finally {
-        setTimeout(() => document.getElementById('spinner').classList.remove('active'), 1000);
+        console.warn('Veri işleme hatası:', error);
+        setPulseError();
     }
 }
 
+// --- CANLI AKIŞ (SSE) ---
+// Sunucu her yenilemede sadece değişen araçları iter; bağlantı yoksa polling devam eder
+let liveStream = null;
+let liveStreamSupported = false; // /api/veriler X-Live-Stream başlığı (Vercel'de kapalı)
+const LIVE_STREAM_RETRY_MS = 60000;
+
+function startLiveStream() {
+    if (!window.EventSource || !liveStreamSupported || liveStream) return;
+
+    let url = `/api/stream?since=${snapshotVersion}`;
+    if (snapshotEpoch) url += `&epoch=${snapshotEpoch}`;
+
+    liveStream = new EventSource(`${API_BASE}${url}`);
+    liveStream.addEventListener('delta', (e) => {
+        try {
+            applySnapshotDelta(JSON.parse(e.data));
+            onVehiclesUpdated();
+        } catch (err) {
+            console.warn('Akış verisi okunamadı:', err);
+        }
+    });
+    liveStream.onerror = () => {
+        // Tarayıcı kendisi yeniden bağlanır; kalıcı hata (ör. abone sınırı 503) durumunda
+        // polling'e düşülür ve bir süre sonra akış yeniden denenir
+        if (liveStream.readyState === EventSource.CLOSED) {
+            liveStream = null;
+            setTimeout(startLiveStream, LIVE_STREAM_RETRY_MS);
+        }
+    };
+}
+
+function isLiveStreamOpen() {
+    return liveStream && liveStream.readyState === EventSource.OPEN;
+}
+
+function applySnapshotDelta(payload) {
+    if (!payload || !Array.isArray(payload.changed)) return;
+
+    // Tam senkron: sunucu yeniden başladı veya sürümümüz çok eski
+    if (payload.full) vehicleMap.clear();
+
+    (payload.removed || []).forEach(door => vehicleMap.delete(door));
+    payload.changed.forEach(v => {
+        const door = v.vehicleDoorCode || v.busDoorNumber;
+        if (door) vehicleMap.set(door, v);
+    });
+
+    snapshotVersion = payload.version;
+    snapshotEpoch = payload.epoch;
+    allVehicles = Array.from(vehicleMap.values());
+}
+
 function computeCounts(list) {
     const now = Date.now();
     let active = 0;
@@ -284,16 +358,22 @@ function filterVehicles(type = currentFilter) {
     renderVehicles(filtered);
 }
 
+// Sunucu her kayda lastLocationTs (epoch sn) ekler; yoksa metin alanlarından çözülür
+function locationTime(v) {
+    if (typeof v.lastLocationTs === 'number') return v.lastLocationTs * 1000;
+    return parseDateTime(v.lastLocationDate, v.lastLocationTime);
+}
+
 function isActive(v, now) {
     if (!v.lastLocationDate || !v.lastLocationTime) return false;
-    const ts = parseDateTime(v.lastLocationDate, v.lastLocationTime);
+    const ts = locationTime(v);
     const diff = (now - ts) / 1000;
     return diff < 300 && diff > -300;
 }
 
 function isStale(v, now) {
     if (!v.lastLocationDate || !v.lastLocationTime) return false;
-    const ts = parseDateTime(v.lastLocationDate, v.lastLocationTime);
+    const ts = locationTime(v);
     const diff = (now - ts) / 1000;
     return diff >= 86400;
 }
@@ -424,7 +504,7 @@ async function openMap(doorNumber, operator, currentLat, currentLng, lastDate, l
     console.log('openMap', doorNumber, currentLat, currentLng);
     currentViewingDoor = doorNumber; // Şu an izlenen aracı kaydet
     cachedBackendHistory = []; // Reset cache for new vehicle
-    fetchData(); // Force list refresh to sync timestamps
+    if (!isLiveStreamOpen()) fetchData(); // Force list refresh to sync timestamps
 
     // Görev Listesini Yükle
     loadVehicleTasks(doorNumber);
@@ -487,6 +567,9 @@ async function openMap(doorNumber, operator, currentLat, currentLng, lastDate, l
         // Fix: Use 'topleft' to avoid overlap with 'Yol Tarifi' (topright)
         const overlayMaps = { "🛰️ Uydu Görünümü": satelliteMap };
         L.control.layers(null, overlayMaps, { position: 'topleft' }).addTo(map);
+
+        viewportLayer = L.layerGroup().addTo(map);
+        map.on('moveend', loadViewportVehicles);
     }
 
     // Haritayı temizle
@@ -502,6 +585,40 @@ async function openMap(doorNumber, operator, currentLat, currentLng, lastDate, l
     // Harita boyutunu güncelle ve geçmişi çiz
     setTimeout(() => map.invalidateSize(), 150);
     await updateMapDisplay(doorNumber, currentLat, currentLng, lastDate, lastTime, true);
+    loadViewportVehicles();
+}
+
+// Sadece haritada görünen araçları sunucudan ister (yakın zoom seviyelerinde)
+async function loadViewportVehicles() {
+    if (!map || !viewportLayer || !currentViewingDoor) return;
+    const requestId = ++viewportRequestId;
+    if (map.getZoom() < VIEWPORT_MIN_ZOOM) {
+        viewportLayer.clearLayers();
+        return;
+    }
+
+    try {
+        const bbox = map.getBounds().toBBoxString();
+        const response = await apiFetch(`/api/vehicles/bbox?bbox=${bbox}&limit=500&fields=vehicleDoorCode,busDoorNumber,latitude,longitude`);
+        if (!response.ok || requestId !== viewportRequestId) return;
+        const vehicles = await response.json();
+        if (requestId !== viewportRequestId) return;
+
+        viewportLayer.clearLayers();
+        vehicles.forEach(v => {
+            const door = v.vehicleDoorCode || v.busDoorNumber;
+            if (door === currentViewingDoor) return;
+            L.circleMarker([Number(v.latitude), Number(v.longitude)], {
+                radius: 5,
+                color: '#64748b',
+                fillColor: '#94a3b8',
+                fillOpacity: 0.8,
+                weight: 1
+            }).bindTooltip(door || '').addTo(viewportLayer);
+        });
+    } catch (err) {
+        console.warn('Viewport vehicles error:', err);
+    }
 }
 
 
@@ -518,6 +635,8 @@ function closeMap() {
     }
     markers.forEach(m => map.removeLayer(m));
     markers = [];
+    viewportRequestId++;
+    if (viewportLayer) viewportLayer.clearLayers();
 
     document.getElementById('mapModal').classList.remove('active');
 
@@ -750,8 +869,8 @@ function downloadExcel() {
     const now = Date.now();
 
     const sorted = data.slice(0, 5000).sort((a, b) => {
-        const tA = parseDateTime(a.lastLocationDate, a.lastLocationTime);
-        const tB = parseDateTime(b.lastLocationDate, b.lastLocationTime);
+        const tA = locationTime(a);
+        const tB = locationTime(b);
         return tB - tA;
     });
 
@@ -961,6 +1080,7 @@ async function checkUserStatus() {
 document.addEventListener('DOMContentLoaded', () => {
     console.log("App starting...");
     checkUserStatus(); // Check user
-    fetchData(); // Initial fetch
-    setInterval(fetchData, 2000); // Poll every 2 seconds
+    fetchData().then(startLiveStream); // Initial fetch, then live stream
+    // Poll every 2 seconds (only while the live stream is not connected)
+    setInterval(() => { if (!isLiveStreamOpen()) fetchData(); }, 2000);
 });
\ No newline at end of file